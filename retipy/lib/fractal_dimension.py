@@ -12,26 +12,133 @@ import numpy as np
 
 def fractal_dimension(b_image):
     """
-    Calculates the fractal dimension of the given binary image Z
-    :param b_image: a binary 2d image
-    :return: the Minkowski–Bouligand dimension of the image
+    Calculates the fractal dimension of the given binary image Z, or of every image of a batch
+    :param b_image: a binary 2d image, or a [n, height, width] batch of them
+    :return: the Minkowski–Bouligand dimension of the image, or an array with the one of each image
     """
 
-    # Only for 2d image
-    assert(len(b_image.shape) == 2)
+    # Only for 2d images
+    assert(len(b_image.shape) in (2, 3))
 
-    # From https://github.com/rougier/numpy-100 (#87)
-    def boxcount(Z, k):
-        S = np.add.reduceat(
-            np.add.reduceat(Z, np.arange(0, Z.shape[0], k), axis=0),
-                               np.arange(0, Z.shape[1], k), axis=1)
+    images = b_image if b_image.ndim == 3 else b_image[np.newaxis]
+    sizes = _box_sizes(min(images.shape[1:]))
+    counts = _box_counts(images, sizes)
 
-        # We count non-empty (0) and non-full boxes (k*k)
-        return len(np.where((S > 0) & (S < k*k))[0])
+    dimensions = np.array([_dimension(sizes, image_counts) for image_counts in counts])
+    return dimensions if b_image.ndim == 3 else dimensions[0]
 
-    # Minimal dimension of image
-    p = min(b_image.shape)
 
+def _box_counts(images, sizes):
+    """
+    Counts the non-empty (0) and non-full (k*k) boxes of every size in each image. The boxes are
+    the levels of a dyadic pyramid, where each level is the 2x2 sum of the previous one, so the
+    images are read once for all the sizes. The images are padded with zeros up to a multiple of
+    the greatest size, the boxes on the right and bottom borders are then as big as the others but
+    the padding never fills them.
+    :param images: a [n, height, width] batch of images
+    :param sizes: the box sizes, powers of two in decreasing order
+    :return: a [n, len(sizes)] array with the box counts
+    """
+    n, height, width = images.shape
+    greatest = sizes[0] if len(sizes) else 1
+    if np.issubdtype(images.dtype, np.floating):
+        dtype = np.float64
+    elif images.dtype in (np.bool_, np.uint8):
+        # boxes up to 1024 pixels wide sum at most 255 * 2**20
+        dtype = np.int32 if greatest < 2**11 else np.int64
+    else:
+        dtype = np.int64
+    pyramid = np.zeros(
+        [n, -(-height // greatest) * greatest, -(-width // greatest) * greatest], dtype=dtype)
+    pyramid[:, :height, :width] = images
+
+    counts = np.zeros([n, len(sizes)], dtype=int)
+    size = 1
+    while size < greatest:
+        pyramid = \
+            pyramid[:, 0::2, 0::2] + pyramid[:, 1::2, 0::2] + pyramid[:, 0::2, 1::2] + pyramid[:, 1::2, 1::2]
+        size *= 2
+        if size in sizes:
+            counts[:, list(sizes).index(size)] = np.count_nonzero(
+                (pyramid > 0) & (pyramid < size * size), axis=(1, 2))
+    return counts
+
+
+def fractal_dimension_points(x, y, dimension):
+    """
+    Calculates the fractal dimension of the binary image of side dimension whose true pixels are
+    the given points, without building the image. The points are hashed into their box at each box
+    size, so the cost depends on the number of points instead of on the image size.
+    :param x: the row of each point, in [0, dimension)
+    :param y: the column of each point, in [0, dimension)
+    :param dimension: the side of the square image that contains the points
+    :return: the Minkowski–Bouligand dimension of the image, same as fractal_dimension would give
+    """
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    # a pixel is counted once, no matter how many points fall on it
+    pixels = np.unique(x * dimension + y)
+    x = pixels // dimension
+    y = pixels % dimension
+
+    sizes = _box_sizes(dimension)
+    counts = []
+    for size in sizes:
+        _, box_pixels = np.unique(
+            (x // size) * (dimension // size) + y // size, return_counts=True)
+        # We count non-full boxes (k*k), the empty ones are not there
+        counts.append(np.count_nonzero(box_pixels < size * size))
+
+    return _dimension(sizes, counts)
+
+
+def fractal_dimension_point_sets(x, y, ids, dimensions):
+    """
+    Calculates fractal_dimension_points of many sets of points at once. The boxes of every size are
+    hashed together for all the sets, and the sets with the same image side are fitted together.
+    :param x: the row of each point, in [0, dimension) of its set
+    :param y: the column of each point, in [0, dimension) of its set
+    :param ids: the set of each point, from 0 to len(dimensions) - 1
+    :param dimensions: the side of the square image that contains each set
+    :return: an array with the Minkowski–Bouligand dimension of each set, nan for the empty ones
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    dimensions = np.asarray(dimensions, dtype=np.int64)
+    result = np.full(dimensions.size, np.nan)
+    if not ids.size:
+        return result
+    # every key below fits a [set, row, column] grid with the greatest side
+    side = int(dimensions[np.unique(ids)].max()) + 1
+    pixels = np.unique((ids * side + np.asarray(x, dtype=np.int64)) * side + np.asarray(y, dtype=np.int64))
+    ids = pixels // (side * side)
+    x = pixels // side % side
+    y = pixels % side
+
+    sizes = _box_sizes(side)
+    counts = np.zeros([dimensions.size, len(sizes)], dtype=int)
+    for i, size in enumerate(sizes):
+        boxes = side // size + 1
+        keys, box_pixels = np.unique(
+            (ids * boxes + x // size) * boxes + y // size, return_counts=True)
+        # We count non-full boxes (k*k), the empty ones are not there
+        counts[:, i] = np.bincount(keys[box_pixels < size * size] // (boxes * boxes), minlength=dimensions.size)
+
+    present = np.bincount(ids, minlength=dimensions.size) > 0
+    for dimension in np.unique(dimensions[present]):
+        sets = np.flatnonzero(present & (dimensions == dimension))
+        set_sizes = _box_sizes(dimension)
+        coeffs = np.polyfit(
+            np.log(set_sizes), np.log(counts[sets][:, np.searchsorted(-sizes, -set_sizes)]).T, 1)
+        result[sets] = -coeffs[0]
+    return result
+
+
+def _box_sizes(p):
+    """
+    Box sizes used to count an image with p as its minimal dimension
+    :param p: the minimal dimension of the image
+    :return: the powers of two from the greatest one less than or equal to p down to 4
+    """
     # Greatest power of 2 less than or equal to p
     n = 2**np.floor(np.log(p)/np.log(2))
 
@@ -39,14 +146,16 @@ def fractal_dimension(b_image):
     n = int(np.log(n)/np.log(2))
 
     # Build successive box sizes (from 2**n down to 2**1)
-    sizes = 2**np.arange(n, 1, -1)
+    return 2**np.arange(n, 1, -1)
 
-    # Actual box counting with decreasing size
-    counts = []
-    for size in sizes:
-        counts.append(boxcount(b_image, size))
 
-    # Fit the successive log(sizes) with log (counts)
+def _dimension(sizes, counts):
+    """
+    Fits the successive log(sizes) with log(counts)
+    :param sizes: the box sizes
+    :param counts: the box count of each size
+    :return: the Minkowski–Bouligand dimension
+    """
     coeffs = np.polyfit(np.log(sizes), np.log(counts), 1)
     return -coeffs[0]
 
@@ -1,25 +1,33 @@
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
+import collections
 import copy
+import functools
+import os
 import time
+import types
 import imutils
 
 
+_base_directory_templates = os.path.join(os.path.dirname(__file__), 'templates_od/')
+template1 = _base_directory_templates + "od1.png"
+template2 = _base_directory_templates + "od2.png"
+template3 = _base_directory_templates + "od3.png"
+template4 = _base_directory_templates + "od4.png"
 
-template1 = "./retipy/retipy/templates_od/od1.png"
-template2 = "./retipy/retipy/templates_od/od2.png"
-template3 = "./retipy/retipy/templates_od/od3.png"
-template4 = "./retipy/retipy/templates_od/od4.png"
-"""
-#test
-template1 = "../retipy/templates_od/od1.png"
-template2 = "../retipy/templates_od/od2.png"
-template3 = "../retipy/templates_od/od3.png"
-template4 = "../retipy/templates_od/od4.png"
-"""
+# half of the side of the square window compared against the optic disc templates
+_window_radius = 40
 
-classification_scale = {"Normal": 0, "Medium": 0,"Large": 0}
+# names of the size classification scales 1, 2 and 3 of size_drusen
+_scales = ("Normal", "Medium", "Large")
+
+# a detected drusen, its contour, its minimum area (center, size, angle) rectangle and its scale
+Drusen = collections.namedtuple("Drusen", ["contour", "rect", "scale"])
+
+# result of a single drusen detection: the annotated image, the read only count of drusen of each
+# scale name and the detected drusen
+DrusenResult = collections.namedtuple("DrusenResult", ["image", "counts", "drusen"])
 
 def show_image(image, tittle):
     pass
@@ -30,33 +38,14 @@ def show_image(image, tittle):
 
 def removing_dark_pixel(image):
     b, g, r = cv2.split(image)
-    rows, cols,_ = image.shape
-    new_matriz = np.zeros((rows, cols))
     average = np.average(r)
-    max = np.amax(image)
-
-    total = 0
-    for i in range(0, rows):
-        for j in range(0, cols):
-            total += image[i][j][0]
-            if r[i][j] <= average:
-                image[i][j][0] = 0
-                image[i][j][1] = 0
-                image[i][j][2] = 0
+    image[r <= average] = 0
     return image
 
 
 def threshold(img, t):
-    rows, cols = img.shape
-    new_matriz = np.zeros((rows, cols))
     # creating binary matrix
-    for i in range(0, rows):
-        for j in range(0, cols):
-            if img[i][j] >= t:
-                new_matriz[i][j] = 1
-            else:
-                new_matriz[i][j] = 0
-    return new_matriz
+    return (img >= t).astype(np.float64)
 
 
 def detect_roi(img, optic_disc):
@@ -121,14 +110,7 @@ def get_mask(img):
 
 
 def apply_mask(img, mask):
-    rows, cols, _ = img.shape
-
-    for i in range(0, rows):
-        for j in range(0, cols):
-            if mask[i][j] == 0:
-                img[i][j][0] = 0
-                img[i][j][1] = 0
-                img[i][j][2] = 0
+    img[mask == 0] = 0
     return img
 
 
@@ -141,7 +123,12 @@ def aux_template_optic_disc(template):
     return [blue_hist, green_hist, red_hist]
 
 
+@functools.lru_cache(maxsize=None)
 def template_optic_disc():
+    """
+    Average blue, green and red histograms of the optic disc templates. The templates are only
+    read once per process, the returned array is read only.
+    """
     hist1 = aux_template_optic_disc(template1)
     hist2 = aux_template_optic_disc(template2)
     hist3 = aux_template_optic_disc(template3)
@@ -159,7 +146,9 @@ def template_optic_disc():
     for i in range(0, 256):
         red_hist.append((hist1[2][i] + hist2[2][i] + hist3[2][i] + hist4[2][i]) / 4)
 
-    return [blue_hist, green_hist, red_hist]
+    histograms = np.array([blue_hist, green_hist, red_hist])
+    histograms.setflags(write=False)
+    return histograms
 
 
 def hist_window(image, y, x):
@@ -188,18 +177,76 @@ def hist_correlation(templates_histograms, histograms_window):
     return C
 
 
+def correlation_map(image, templates_histograms, rows, stride=1):
+    """
+    Calculates hist_correlation for the window centred on every non black pixel of the given rows.
+
+    Instead of building the histograms of each window, a histogram per column of the current band
+    of rows is kept and updated when the band moves down, the window histograms are the
+    difference of the running sum of the column histograms. Windows are clipped with the same
+    rules of the slices of hist_window, in the rows and in the columns.
+    :param image: a BGR image
+    :param templates_histograms: the output of template_optic_disc
+    :param rows: the rows to evaluate, in increasing order
+    :param stride: evaluate only one of every stride rows and columns
+    :return: a float matrix with the correlation of each evaluated pixel and zero elsewhere
+    """
+    height, cols, depth = image.shape
+    new_matriz = np.zeros((height, cols))
+    rows = list(rows)[::stride]
+    if not rows:
+        return new_matriz
+    templates = np.asarray(templates_histograms, dtype=np.float64).reshape(depth, 1, 256)
+
+    # same start and end of the window columns than the slices of hist_window
+    centers = np.arange(0, cols, stride)
+    start = centers - _window_radius
+    start[start < 0] += cols
+    end = np.minimum(centers + _window_radius, cols)
+    empty = start >= end
+
+    channels = np.arange(0, depth).reshape(depth, 1)
+    columns = np.arange(0, cols).reshape(1, cols)
+    # a window has at most 80x80 pixels, so the int16 difference of the running sums is exact even
+    # when the running sums wrap around
+    band = np.zeros((depth, cols, 256), dtype=np.int16)
+    band_top = band_bottom = 0
+    for i in rows:
+        # same start and end of the window rows than the slices of hist_window
+        top = i - _window_radius if i >= _window_radius else i - _window_radius + height
+        bottom = min(i + _window_radius, height)
+        if top >= bottom:
+            # the slice is empty, and so is the window
+            top = bottom = band_top
+        if top < band_top or top >= band_bottom or bottom < band_bottom:
+            band[:] = 0
+            band_top = band_bottom = top
+        # move the band to [top, bottom)
+        while band_top < top:
+            band[channels, columns, image[band_top].T] -= 1
+            band_top += 1
+        while band_bottom < bottom:
+            band[channels, columns, image[band_bottom].T] += 1
+            band_bottom += 1
+
+        candidates = image[i, centers, 0] != 0
+        if not candidates.any():
+            continue
+        accumulated = np.zeros((depth, cols + 1, 256), dtype=np.int16)
+        np.cumsum(band, axis=1, dtype=np.int16, out=accumulated[:, 1:])
+        window = accumulated[:, end[candidates]] - accumulated[:, start[candidates]]
+        window[:, empty[candidates]] = 0
+        difference = np.sum((templates - window) ** 2, axis=2)
+        correlation = 1 / (1 + difference)
+        new_matriz[i, centers[candidates]] = \
+            (0.5 * correlation[2]) + (1 * correlation[0]) + (2 * correlation[1])
+    return new_matriz
+
+
 def threshold_color(otsu_img,img):
     b, g, r = cv2.split(img)
     average = np.average(g)
-    rows, cols = otsu_img.shape
-
-    for i in range(0, rows):
-        for j in range(0, cols):
-
-            if otsu_img[i][j] != 0:
-                if g[i][j] < average:
-                    otsu_img[i][j] = 0
-
+    otsu_img[(otsu_img != 0) & (g < average)] = 0
     return otsu_img
 
 def non_uniform_ilumination_correction(img):
@@ -218,6 +265,12 @@ def non_uniform_ilumination_correction(img):
 
 
 def detect_drusen(img):
+    """
+    Segments the drusen of the given region of interest and draws their contours on it, coloured by
+    their size scale.
+    :param img: the BGR region of interest, it is modified in place
+    :return: a DrusenResult with the annotated image, the counts and the detected drusen
+    """
 
     b, g, r = cv2.split(img)
 
@@ -265,6 +318,7 @@ def detect_drusen(img):
     otsu_img = cv2.morphologyEx(otsu_img, cv2.MORPH_OPEN, kernel)
 
     contours,_ = cv2.findContours(otsu_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    detected = []
 
     # print("contornos",len(contours))
 
@@ -297,6 +351,8 @@ def detect_drusen(img):
         #show_image(imutils.resize(im, width=700),"contornos rect")
         # calculate the size drusen and return the size classification scale
         classification = size_drusen(rect[1])
+        c.setflags(write=False)
+        detected.append(Drusen(c, rect, classification))
 
         # Normal drusen
         if classification == 1:
@@ -324,7 +380,11 @@ def detect_drusen(img):
 
 
     show_image(imutils.resize(img, width=700),"contornos")
-    return img
+    counts = collections.Counter(_scales[drusen.scale - 1] for drusen in detected)
+    return DrusenResult(
+        img,
+        types.MappingProxyType({name: counts[name] for name in _scales}),
+        tuple(detected))
 
 
 
@@ -344,21 +404,44 @@ def size_drusen(dimensions):
     scale = 0
     #normal --->   <= 63 micron
     if diameter <= 63:
-        classification_scale["Normal"] += 1
         scale = 1
     #Early AMD --->  Medium Drusen > 63 micron and <= 125 miron
     elif diameter > 63 and diameter <= 125:
-        classification_scale["Medium"] += 1
         scale = 2
     #Intermetiate AMD --> Large Drusen > 125 micron
     else:
-        classification_scale["Large"] += 1
         scale = 3
 
     return scale
 
 
-def detect_optical_disc(image):
+def _bounding_box(gradient):
+    """
+    Returns the [x_min, y_min, x_max, y_max] box of the pixels with value 1, or zeros if there are
+    none. The box restarts on every pixel while y_max is still zero, so pixels of the first row are
+    ignored when there are pixels in other rows, and only the last one is kept otherwise.
+    """
+    y_values, x_values = np.nonzero(gradient == 1)
+    if y_values.size == 0:
+        return [0, 0, 0, 0]
+    if y_values[-1] == 0:
+        return [x_values[-1], 0, x_values[-1], 0]
+    inner = y_values > 0
+    y_values, x_values = y_values[inner], x_values[inner]
+    return [x_values.min(), y_values.min(), x_values.max(), y_values.max()]
+
+
+def detect_optical_disc(image, stride=1):
+    """
+    Finds the center of the optic disc, as the center of the region with the most similar
+    histograms to the optic disc templates.
+
+    When stride is greater than one the histograms are first compared every stride pixels, and
+    then on every pixel of the rows and columns around the best coarse matches.
+    :param image: a BGR image
+    :param stride: distance between the pixels evaluated on the coarse pass
+    :return: the [x, y] position of the optic disc
+    """
     start = time.time()
     # print("mask")
     original_image = copy.copy(image)
@@ -378,28 +461,24 @@ def detect_optical_disc(image):
     # window_histogram = hist_window(image,500,200)
     # hist_correlation(templates_histograms,window_histogram)
 
-    correlations = []
-    new_matriz = np.zeros((rows, cols))
-    # print(rows, cols)
-    for i in range(200, rows-230):
-        # print(i)
-        for j in range(0, cols):
-
-
-            if image[i][j][0] != 0:
-                window_histogram = hist_window(image, i, j)
-                new_matriz[i][j] = hist_correlation(templates_histograms, window_histogram)
-
-    # print("calculando el max")
-    max = new_matriz[0][0]
-    for i in range(0, rows):
-        for j in range(0, cols):
-            if new_matriz[i][j] > max:
-                max = new_matriz[i][j]
+    search_rows = range(200, rows-230)
+    if stride > 1:
+        coarse = correlation_map(image, templates_histograms, search_rows, stride)
+        coarse_y, coarse_x = np.nonzero(coarse >= coarse.max() * 0.7)
+        if coarse_y.size:
+            first_row, last_row = np.clip(
+                [coarse_y.min() - stride, coarse_y.max() + stride + 1], 200, rows - 230)
+            first_col, last_col = np.clip(
+                [coarse_x.min() - stride, coarse_x.max() + stride + 1], 0, cols)
+            new_matriz = correlation_map(image, templates_histograms, range(first_row, last_row))
+            new_matriz[:, :first_col] = 0
+            new_matriz[:, last_col:] = 0
+        else:
+            new_matriz = coarse
+    else:
+        new_matriz = correlation_map(image, templates_histograms, search_rows)
 
-    # print("max", max)
-    # print("threshold")
-    image_threshold = threshold(new_matriz, max * 0.7)
+    image_threshold = threshold(new_matriz, new_matriz.max() * 0.7)
     end = time.time()
     # print(end - start)
     kernel = np.ones((3, 3), np.uint8)
@@ -409,27 +488,7 @@ def detect_optical_disc(image):
     # show_image(gradient, "gradient")
 
     # calulating the center of optic disc
-    x_min = 0
-    y_min = 0
-    x_max = 0
-    y_max = 0
-    for i in range(0, rows):
-        for j in range(0, cols):
-            # only enter one time
-            if gradient[i][j] == 1 and y_max == 0:
-                # initial definition only one time enter here
-                y_min = i
-                x_min = j
-                x_max = j
-            if gradient[i][j] == 1:
-                y_max = i
-
-                if x_min > j:
-                    x_min = j
-                elif x_max < j:
-                    x_max = j
-
-    # print(x_min, x_max, y_min, y_max)
+    x_min, y_min, x_max, y_max = _bounding_box(gradient)
     y = int(y_min + ((y_max - y_min) / 2))
     x = int(x_min + ((x_max - x_min) / 2))
 
@@ -464,6 +523,12 @@ def change_resolution(img):
 
 
 def main(image, debug = False):
+    """
+    Detects and classifies by size the drusen around the macula of the given fundus image.
+    :param image: a BGR fundus image
+    :param debug: print the current stage
+    :return: a DrusenResult with the annotated region of interest, the counts and the drusen
+    """
 
     original_image = copy.copy(image)
     if debug:
@@ -497,7 +562,5 @@ def main(image, debug = False):
     if debug:
         print("# Segmenting Drusen")
     print(roi.shape)
-    drusen = detect_drusen(roi)
-
-
-    return [drusen,classification_scale]
+    # every call gets its own result, so concurrent calls do not share any count
+    return detect_drusen(roi)
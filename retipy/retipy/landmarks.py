@@ -16,125 +16,193 @@
 
 """Module with operations related to detect and classify crossings and bifurcations."""
 
+from concurrent.futures import ProcessPoolExecutor
+import functools
 import numpy as np
 import cv2
 from retipy import retina
+from retipy import vessel_width as vw
 
 
 def potential_landmarks(skeleton_img: np.ndarray, kernel: int):
-    potential = []
     binary = skeleton_img.copy()
     binary[binary == 255] = 1
     result = skeleton_img.copy()
     n = int(np.floor(kernel / 2))
-    for it_x in range(n, binary.shape[0] - n):
-        for it_y in range(n, binary.shape[1] - n):
-            aux = 0
-            if binary[it_x, it_y] == 1:
-                aux += np.sum(binary[it_x - n:it_x + n + 1, it_y - n:it_y + n + 1])
-                if aux == 4:
-                    result[it_x, it_y] = 0
-                    potential.append([it_x, it_y])
-                elif aux >= 5:
-                    result[it_x, it_y] = 0
-                    potential.append([it_x, it_y])
-    return potential, result
+    size = 2 * n + 1
+    if binary.shape[0] < size or binary.shape[1] < size:
+        return [], result
+
+    # summed area table, the neighbourhood sum of every interior pixel comes from its four corners
+    table = np.zeros((binary.shape[0] + 1, binary.shape[1] + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(binary, axis=0, dtype=np.int64), axis=1, out=table[1:, 1:])
+    sums = table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+
+    interior = binary[n:binary.shape[0] - n, n:binary.shape[1] - n]
+    rows, columns = np.nonzero((interior == 1) & (sums >= 4))
+    rows += n
+    columns += n
+    result[rows, columns] = 0
+    return np.column_stack((rows, columns)).tolist(), result
 
 
 def vessel_width(thresholded_image: np.ndarray, landmarks: list):
-    image = thresholded_image.copy()
-    widths = []
-    for j in landmarks:
-        w0 = w45 = w90 = w135 = 0
-        w180 = w225 = w270 = w315 = 1
-        while True:
-            if image[j[0], j[1] + w0 + 1] != 0:
-                w0 += 1
-            if image[j[0], j[1] - w180 - 1] != 0:
-                w180 += 1
-            if image[j[0] - w45 - 1, j[1] + w45 + 1] != 0:
-                w45 += 1
-            if image[j[0] + w225 + 1, j[1] - w225 - 1] != 0:
-                w225 += 1
-            if image[j[0] - w90 - 1, j[1]] != 0:
-                w90 += 1
-            if image[j[0] + w270 + 1, j[1]] != 0:
-                w270 += 1
-            if image[j[0] - w135 - 1, j[1] - w135 - 1] != 0:
-                w135 += 1
-            if image[j[0] + w315 + 1, j[1] + w315 + 1] != 0:
-                w315 += 1
-
-            if image[j[0], j[1] + w0 + 1] == 0 and image[j[0], j[1] - w180 - 1] == 0:
-                widths.append([0, w0, w180])
-                break
-            elif image[j[0] - w45 - 1, j[1] + w45 + 1] == 0 and image[j[0] + w225 + 1, j[1] - w225 - 1] == 0:
-                widths.append([45, w45, w225])
-                break
-            elif image[j[0] - w90 - 1, j[1]] == 0 and image[j[0] + w270 + 1, j[1]] == 0:
-                widths.append([90, w90, w270])
-                break
-            elif image[j[0] - w135 - 1, j[1] - w135 - 1] == 0 and image[j[0] + w315 + 1, j[1] + w315 + 1] == 0:
-                widths.append([135, w135, w315])
-                break
-
-    return widths
-
-
-def finding_landmark_vessels(widths: list, landmarks: list, skeleton: np.ndarray, skeleton_rgb: np.ndarray):
-    vessels = []
+    points = np.array(landmarks, dtype=np.intp).reshape(-1, 2)
+    return vw.widths(thresholded_image, points[:, 0], points[:, 1]).tolist()
+
+
+@functools.lru_cache(maxsize=None)
+def _circle_offsets(radius: int):
+    """
+    Returns the (row, column) offsets probed around a landmark for the given radius, in the order
+    they are visited: first sweeping the rows and then the columns of the circle.
+    """
+    offsets = []
+    for start in range(0, 2):
+        for rad in range(-radius, radius + 1):
+            dy = int(np.round(np.sqrt(np.power(radius, 2) - np.power(rad, 2))))
+            for sign in [-1, 1]:
+                if start == 0:
+                    offsets.append((rad, sign * dy))
+                else:
+                    offsets.append((sign * dy, rad))
+    return tuple(offsets)
+
+
+def _landmark_vessel_pixelwise(width: list, landmark: list, skeleton: np.ndarray, skeleton_rgb: np.ndarray):
+    """Traces the vessels around a landmark on copies of the whole skeleton images"""
+    cgray = skeleton.copy()
+    crgb = skeleton_rgb.copy()
+    radius = int(np.ceil(width[1] + width[2] * 1.5))
+    x0 = landmark[0]
+    y0 = landmark[1]
+    points = []
+    dy = x = y = 0
+    crgb[x0, y0] = [0, 255, 0]
+    for start in range(0, 2):
+        for rad in range(-radius, radius + 1):
+            dy = int(np.round(np.sqrt(np.power(radius, 2) - np.power(rad, 2))))
+            for loop in range(0, 2):
+                if start == 0:
+                    x = x0 + rad
+                    if loop == 0:
+                        y = y0 - dy
+                    else:
+                        y = y0 + dy
+                else:
+                    y = y0 + rad
+                    if loop == 0:
+                        x = x0 - dy
+                    else:
+                        x = x0 + dy
+
+                acum = 0
+                for i in range(-2, 3):
+                    for j in range(-2, 3):
+                        if all(crgb[x + i, y + j] == [0, 0, 255]):
+                            acum += 1
+
+                if cgray[x, y] == 255 and acum == 0:
+                    crgb[x, y] = [0, 0, 255]
+                    cgray[x - 1:x + 2, y - 1:y + 2] = 0
+                    cgray[x, y] = 255
+                    points.append([x, y])
+                elif acum == 0:
+                    crgb[x, y] = [255, 0, 0]
+                    block = cgray[x - 1:x + 2, y - 1:y + 2]
+                    connected_components = cv2.connectedComponentsWithStats(block.astype(np.uint8), 8, cv2.CV_8U)
+                    for k in range(1, connected_components[0]):
+                        mask = connected_components[1] == k
+                        indexes = np.column_stack(np.where(mask))
+                        for e in range(0, len(indexes)):
+                            ix = x + indexes[e][0] - 1
+                            iy = y + indexes[e][1] - 1
+                            if e == int(len(indexes) / 2):
+                                crgb[ix, iy] = [0, 0, 255]
+                                points.append([ix, iy])
+
+    return points
+
+
+def _trace_landmark(gray: np.ndarray, blue: np.ndarray, x0: int, y0: int, radius: int):
+    """
+    Traces the vessels around a landmark, as _landmark_vessel_pixelwise does, on a patch that
+    contains the whole circle and its 5x5 neighbourhoods. Only the pixels marked in blue change the
+    result, so the RGB skeleton is reduced to a boolean mask of them.
+    :param gray: the skeleton patch, it is modified
+    :param blue: mask of the blue pixels of the patch, it is modified
+    :return: the vessel points, in patch coordinates
+    """
+    points = []
+    blue[x0, y0] = False
+    for dx, dy in _circle_offsets(radius):
+        x = x0 + dx
+        y = y0 + dy
+        if blue[x - 2:x + 3, y - 2:y + 3].any():
+            continue
+
+        if gray[x, y] == 255:
+            blue[x, y] = True
+            gray[x - 1:x + 2, y - 1:y + 2] = 0
+            gray[x, y] = 255
+            points.append([x, y])
+        else:
+            block = gray[x - 1:x + 2, y - 1:y + 2]
+            connected_components = cv2.connectedComponentsWithStats(block.astype(np.uint8), 8, cv2.CV_8U)
+            for k in range(1, connected_components[0]):
+                indexes = np.column_stack(np.where(connected_components[1] == k))
+                ix, iy = indexes[int(len(indexes) / 2)] + [x - 1, y - 1]
+                blue[ix, iy] = True
+                points.append([ix, iy])
+    return points
+
+
+def _trace_landmark_task(task: tuple):
+    gray, blue, x0, y0, radius, top, left = task
+    return [[x + top, y + left] for x, y in _trace_landmark(gray, blue, x0, y0, radius)]
+
+
+def finding_landmark_vessels(widths: list, landmarks: list, skeleton: np.ndarray, skeleton_rgb: np.ndarray,
+                             workers: int = 1):
+    """
+    Finds the vessel points around each landmark, probing a circle whose radius depends on the
+    vessel width.
+
+    Each landmark works on a copy of the small patch around it, landmarks whose circle reaches the
+    border of the image use copies of the whole images instead. The patches are independent, so
+    they can be traced in several processes.
+    :param widths: the vessel width of each landmark, as returned by vessel_width
+    :param landmarks: the landmark points
+    :param skeleton: the skeleton image, with vessels as 255
+    :param skeleton_rgb: the BGR version of the skeleton
+    :param workers: the number of processes used to trace the landmarks
+    :return: a list with the vessel points of every landmark
+    """
+    blue = np.all(skeleton_rgb == [0, 0, 255], axis=2)
+    vessels = [None] * len(widths)
+    tasks = []
+    indexes = []
     for l in range(0, len(widths)):
-        cgray = skeleton.copy()
-        crgb = skeleton_rgb.copy()
         radius = int(np.ceil(widths[l][1] + widths[l][2] * 1.5))
         x0 = landmarks[l][0]
         y0 = landmarks[l][1]
-        points = []
-        dy = x = y = 0
-        crgb[x0, y0] = [0, 255, 0]
-        for start in range(0, 2):
-            for rad in range(-radius, radius + 1):
-                dy = int(np.round(np.sqrt(np.power(radius, 2) - np.power(rad, 2))))
-                for loop in range(0, 2):
-                    if start == 0:
-                        x = x0 + rad
-                        if loop == 0:
-                            y = y0 - dy
-                        else:
-                            y = y0 + dy
-                    else:
-                        y = y0 + rad
-                        if loop == 0:
-                            x = x0 - dy
-                        else:
-                            x = x0 + dy
-
-                    acum = 0
-                    for i in range(-2, 3):
-                        for j in range(-2, 3):
-                            if all(crgb[x + i, y + j] == [0, 0, 255]):
-                                acum += 1
-
-                    if cgray[x, y] == 255 and acum == 0:
-                        crgb[x, y] = [0, 0, 255]
-                        cgray[x - 1:x + 2, y - 1:y + 2] = 0
-                        cgray[x, y] = 255
-                        points.append([x, y])
-                    elif acum == 0:
-                        crgb[x, y] = [255, 0, 0]
-                        block = cgray[x - 1:x + 2, y - 1:y + 2]
-                        connected_components = cv2.connectedComponentsWithStats(block.astype(np.uint8), 8, cv2.CV_8U)
-                        for k in range(1, connected_components[0]):
-                            mask = connected_components[1] == k
-                            indexes = np.column_stack(np.where(mask))
-                            for e in range(0, len(indexes)):
-                                ix = x + indexes[e][0] - 1
-                                iy = y + indexes[e][1] - 1
-                                if e == int(len(indexes) / 2):
-                                    crgb[ix, iy] = [0, 0, 255]
-                                    points.append([ix, iy])
-
-        vessels.append(points)
+        margin = radius + 2
+        if x0 - margin < 0 or y0 - margin < 0 or \
+                x0 + margin >= skeleton.shape[0] or y0 + margin >= skeleton.shape[1]:
+            vessels[l] = _landmark_vessel_pixelwise(widths[l], landmarks[l], skeleton, skeleton_rgb)
+            continue
+        window = (slice(x0 - margin, x0 + margin + 1), slice(y0 - margin, y0 + margin + 1))
+        tasks.append((skeleton[window].copy(), blue[window].copy(), margin, margin, radius,
+                      x0 - margin, y0 - margin))
+        indexes.append(l)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            traced = list(executor.map(_trace_landmark_task, tasks, chunksize=32))
+    else:
+        traced = [_trace_landmark_task(task) for task in tasks]
+    for l, points in zip(indexes, traced):
+        vessels[l] = points
     return vessels
 
 
@@ -177,15 +245,55 @@ def boxes_auxiliary(skeleton: np.ndarray, landmarks: list, size: int, bifurcatio
     return landmarks
 
 
+def _landmark_grid(landmarks: list, cell: int):
+    """Groups the indexes of the landmarks by the grid cell of the given size that contains them"""
+    grid = {}
+    for index, landmark in enumerate(landmarks):
+        grid.setdefault((landmark[0] // cell, landmark[1] // cell), []).append(index)
+    return grid
+
+
 def principal_boxes(skeleton: np.ndarray, landmarks: list, size: int):
-    junct = landmarks.copy()
+    """
+    Groups the landmarks in 7x7 boxes, as repeated calls to boxes_auxiliary do: the first landmark
+    not grouped yet is the centre of a box that takes every other landmark inside it, and the box is
+    a bifurcation when it contains more bifurcation (blue) than crossing (red) pixels.
+
+    The landmarks are hashed in a grid of 7x7 cells, so only the landmarks of the 9 cells around a
+    box are checked and every landmark is visited once.
+    :param skeleton: the BGR skeleton with the landmarks marked, as returned by vessel_number
+    :param landmarks: the landmark points
+    :param size: the border added to the image, the box coordinates are moved by it
+    :return: the bifurcation and crossing boxes, as [x_min, y_min, x_max, y_max] lists
+    """
     bifurcations_coordinates = []
     crossings_coordinates = []
-    while True:
-        if junct:
-            junct = boxes_auxiliary(skeleton, junct, size, bifurcations_coordinates, crossings_coordinates)
+    bifurcation_pixels = np.all(skeleton == [0, 0, 255], axis=2)
+    crossing_pixels = np.all(skeleton == [255, 0, 0], axis=2)
+    cell = 7
+    grid = _landmark_grid(landmarks, cell)
+    grouped = np.zeros(len(landmarks), dtype=bool)
+    box = np.arange(-3, 4)
+    for index, landmark in enumerate(landmarks):
+        if grouped[index]:
+            continue
+        x = landmark[0]
+        y = landmark[1]
+        for cell_x in range(x // cell - 1, x // cell + 2):
+            for cell_y in range(y // cell - 1, y // cell + 2):
+                for other in grid.get((cell_x, cell_y), []):
+                    if abs(landmarks[other][0] - x) <= 3 and abs(landmarks[other][1] - y) <= 3:
+                        grouped[other] = True
+
+        # indexed per pixel, so boxes over the border wrap around as in boxes_auxiliary
+        rows = (x + box)[:, np.newaxis]
+        columns = (y + box)[np.newaxis, :]
+        num_bifurcations = np.count_nonzero(bifurcation_pixels[rows, columns])
+        num_crossings = np.count_nonzero(crossing_pixels[rows, columns])
+        if num_bifurcations > num_crossings:
+            bifurcations_coordinates.append([y - 3 - size, x - 3 - size, y + 3 - size, x + 3 - size])
         else:
-            break
+            crossings_coordinates.append([y - 3 - size, x - 3 - size, y + 3 + size, x + 3 + size])
 
     return bifurcations_coordinates, crossings_coordinates
 
@@ -16,6 +16,8 @@
 
 """Module with common mathematical operators that could be reused elsewhere"""
 
+import numpy as np
+
 
 def derivative1_forward_h2(target, y):
     """
@@ -54,3 +56,27 @@ def derivative2_centered_h1(target, y):
     if len(y) - 1 <= target <= 0:
         raise(ValueError("Invalid target, array size {}, given {}".format(len(y), target)))
     return (y[target + 1] - 2*y[target] + y[target - 1])/4
+
+
+def derivatives1_centered_h1(y):
+    """
+    Array version of derivative1_centered_h1, calculates the first derivative of every point that
+    has a neighbour on both sides. Multidimensional arrays are derived along their last axis.
+
+    :param y: an array with the values
+    :return: an array with the centered derivatives of the points 1 to len(y)-2
+    """
+    y = np.asarray(y)
+    return (y[..., 2:] - y[..., :-2])/2
+
+
+def derivatives2_centered_h1(y):
+    """
+    Array version of derivative2_centered_h1, calculates the second derivative of every point that
+    has a neighbour on both sides. Multidimensional arrays are derived along their last axis.
+
+    :param y: an array with the values
+    :return: an array with the centered second derivatives of the points 1 to len(y)-2
+    """
+    y = np.asarray(y)
+    return (y[..., 2:] - 2*y[..., 1:-1] + y[..., :-2])/4
@@ -26,7 +26,8 @@ from lib import thinning
 from matplotlib import pyplot as plt
 from os import path
 from PIL import Image
-from scipy import ndimage
+from scipy import ndimage, sparse
+from scipy.sparse import csgraph
 from skimage import color, feature, filters, io
 from skimage.morphology import skeletonize
 
@@ -44,14 +45,24 @@ class Retina(object):
         return io.imread(img_path)
 
     @staticmethod
-    def get_base64_image(image: np.ndarray, is_luminance: bool = True):
+    def get_png_image(image: np.ndarray, is_luminance: bool = True) -> bytes:
+        """
+        Encodes the given image as png.
+        :param image: the image to encode
+        :param is_luminance: encode the image as a grayscale uint8 image
+        :return: the bytes of the png file
+        """
         if is_luminance:
             temp_image = Image.fromarray(image.astype('uint8'), 'L')
         else:
             temp_image = Image.fromarray(image)
         buffer = BytesIO()
         temp_image.save(buffer, format="png")
-        return str(base64.b64encode(buffer.getvalue()).decode('utf-8'))
+        return buffer.getvalue()
+
+    @staticmethod
+    def get_base64_image(image: np.ndarray, is_luminance: bool = True):
+        return str(base64.b64encode(Retina.get_png_image(image, is_luminance)).decode('utf-8'))
 
     def __init__(self, image: np.ndarray, image_path: str):
         if image is None:
@@ -64,11 +75,30 @@ class Retina(object):
 
         self.segmented = False
         self.old_image = None
-        self.np_image = color.rgb2gray(self.np_image)
-        self.original_base64 = self.get_base64_image(self.np_image)
+        if self.np_image.ndim == 2:
+            # rgb2gray returns 2d images untouched, skip it
+            self.np_image = np.ascontiguousarray(self.np_image)
+        else:
+            self.np_image = color.rgb2gray(self.np_image)
+        self._original_image = self.np_image
+        self._original_base64 = None
         self.depth = 1
         self.shape = self.np_image.shape
 
+    @property
+    def original_base64(self) -> str:
+        """
+        The image given to the constructor (in grayscale) as a base64 png. It is encoded on the first
+        access, changes made in place to np_image before it are part of the encoded image.
+        """
+        if self._original_base64 is None:
+            self._original_base64 = self.get_base64_image(self._original_image)
+        return self._original_base64
+
+    @original_base64.setter
+    def original_base64(self, value: str):
+        self._original_base64 = value
+
 ##################################################################################################
 # Image Processing functions
 
@@ -355,11 +385,36 @@ class Window(Retina):
             raise ValueError("tags is not set")
         if self.mode != self.mode_pytorch:
             self.mode = self.mode_pytorch
+        if not np.issubdtype(self.windows.dtype, np.floating):
+            self.windows = self.windows.astype(np.float64)
 
         for i in range(0, self.tags.shape[0]):
             self.windows[i, -1] = self._create_tag_image(
                 self.windows.shape[2], self.windows.shape[3], self.tags[i])
 
+    @staticmethod
+    def _tile_view(image: np.ndarray, dimension: int, step: int) -> tuple:
+        """
+        Returns a read only view of the square tiles of the given image, without copying it.
+        :param image: a 2d image
+        :param dimension: size of the tiles
+        :param step: distance between the start of consecutive tiles
+        :return: a tuple with the [rows, columns, dimension, dimension] view and the
+                 [rows, columns, 2, 2] array with the position of each tile
+        """
+        rows = (image.shape[0] - dimension) // step + 1
+        columns = (image.shape[1] - dimension) // step + 1
+        tiles = np.lib.stride_tricks.as_strided(
+            image,
+            shape=(rows, columns, dimension, dimension),
+            strides=(step * image.strides[0], step * image.strides[1]) + image.strides,
+            writeable=False)
+        positions = np.empty([rows, columns, 2, 2], dtype=int)
+        positions[:, :, 0, 0] = (np.arange(0, rows) * step)[:, np.newaxis]
+        positions[:, :, 0, 1] = np.arange(0, columns) * step
+        positions[:, :, 1] = positions[:, :, 0] + dimension
+        return tiles, positions
+
     @staticmethod
     def create_windows(
             image: Retina, dimension, method="separated", min_pixels=10) -> tuple:
@@ -376,67 +431,128 @@ class Window(Retina):
         :param min_pixels: ignore windows with less than min_pixels with value.
                            Set to zero to add all windows
         :return: a tuple with its first element as a numpy array with the structure
-                 [window, depth, height, width] and its second element as [window, 2, 2]
-                 with the window position
+                 [window, depth, height, width], with the same type of the image, and its second
+                 element as [window, 2, 2] with the window position
         """
         if image.shape[0] % dimension != 0 or image.shape[1] % dimension != 0:
             raise ValueError(
                 "image shape is not the same or the dimension value does not divide the image "
                 "completely: sx:{} sy:{} dim:{}".format(image.shape[0], image.shape[1], dimension))
 
-        #                      window_count
-        windows = []
-        windows_position = []
-        window_id = 0
-        img_dimension = image.shape[0] if image.shape[0] > image.shape[1] else image.shape[1]
         if method == "separated":
-            windows = np.empty(
-                [(img_dimension // dimension) ** 2, image.depth, dimension, dimension])
-            windows_position = np.empty([(img_dimension // dimension) ** 2, 2, 2], dtype=np.int)
-            for x in range(0, image.shape[0], dimension):
-                for y in range(0, image.shape[1], dimension):
-                    cw = windows_position[window_id]
-                    cw[0, 0] = x
-                    cw[1, 0] = x + dimension
-                    cw[0, 1] = y
-                    cw[1, 1] = y + dimension
-                    t_window = image.np_image[cw[0, 0]:cw[1, 0], cw[0, 1]:cw[1, 1]]
-                    if t_window.sum() >= min_pixels:
-                        windows[window_id, 0] = t_window
-                        window_id += 1
+            tiles, positions = Window._tile_view(image.np_image, dimension, dimension)
         elif method == "combined":
             new_dimension = dimension // 2
-            windows = np.empty(
-                [(img_dimension // new_dimension) ** 2, image.depth, dimension, dimension])
-            windows_position = np.empty([(img_dimension // new_dimension) ** 2, 2, 2], dtype=np.int)
             if image.shape[0] % new_dimension != 0:
                 raise ValueError(
                     "Dimension value '{}' is not valid, choose a value that its half value can split the image evenly"
                     .format(dimension))
-            for x in range(0, image.shape[0] - new_dimension, new_dimension):
-                for y in range(0, image.shape[1] - new_dimension, new_dimension):
-                    cw = windows_position[window_id]
-                    cw[0, 0] = x
-                    cw[1, 0] = x + dimension
-                    cw[0, 1] = y
-                    cw[1, 1] = y + dimension
-                    t_window = image.np_image[cw[0, 0]:cw[1, 0], cw[0, 1]:cw[1, 1]]
-                    if t_window.sum() >= min_pixels:
-                        windows[window_id, 0] = t_window
-                        window_id += 1
-        if window_id <= windows.shape[0]:
-            if window_id == 0:
-                windows = []
-                windows_position = []
-            else:
-                windows = np.resize(
-                    windows, [window_id, windows.shape[1], windows.shape[2], windows.shape[3]])
-                windows_position = np.resize(windows_position, [window_id, 2, 2])
-
-        #  print('created ' + str(window_id) + " windows")
+            tiles, positions = Window._tile_view(image.np_image, dimension, new_dimension)
+        else:
+            return [], []
+
+        # tiles is a view over the image, only the selected ones are copied
+        selected = tiles.sum(axis=(2, 3)) >= min_pixels
+        if not selected.any():
+            return [], []
+        windows = np.empty(
+            [np.count_nonzero(selected), image.depth, dimension, dimension], dtype=image.np_image.dtype)
+        windows[:, 0] = tiles[selected]
+        windows_position = positions[selected]
         return windows, windows_position
 
 
+def pixel_graph(pixels: np.ndarray, start_x: np.ndarray, start_y: np.ndarray):
+    """
+    Builds the graph of the 8-neighbour adjacency of the pixels with value. The nodes are the
+    pixels in row order plus a root node, the last one, linked to the given starting pixels, so a
+    single traversal from the root walks every component that has a start. The neighbours of every
+    node are sorted, a traversal visits them in row order.
+    :param pixels: a boolean image
+    :param start_x: the x of each starting pixel
+    :param start_y: the y of each starting pixel
+    :return: the x and y of each pixel node and the csr graph
+    """
+    node_x, node_y = np.nonzero(pixels)
+    node_count = node_x.size
+    node_ids = np.full(pixels.shape, -1, dtype=np.intp)
+    node_ids[node_x, node_y] = np.arange(node_count)
+    edges_from = [np.full(np.size(start_x), node_count, dtype=np.intp)]
+    edges_to = [node_ids[start_x, start_y]]
+    for dx in range(-1, 2):
+        for dy in range(-1, 2):
+            if dx == 0 and dy == 0:
+                continue
+            n_x = node_x + dx
+            n_y = node_y + dy
+            valid = (n_x >= 0) & (n_x < pixels.shape[0]) & (n_y >= 0) & (n_y < pixels.shape[1])
+            neighbour = node_ids[n_x[valid], n_y[valid]]
+            connected = neighbour >= 0
+            edges_from.append(np.flatnonzero(valid)[connected])
+            edges_to.append(neighbour[connected])
+    edges_from = np.concatenate(edges_from)
+    edges_to = np.concatenate(edges_to)
+    graph = sparse.csr_matrix(
+        (np.ones(edges_from.size, dtype=np.int8), (edges_from, edges_to)),
+        shape=(node_count + 1, node_count + 1))
+    graph.sort_indices()
+    return node_x, node_y, graph
+
+
+def detect_vessels(image: Retina, ignored_pixels=1):
+    """
+    Extracts the vessels of the given image as 8-connected components, without modifying it.
+
+    Each vessel is traversed breadth first from its first pixel (in row order) outside the ignored
+    border, sorted by x and reduced to the first traversed pixel of every x value. All vessels are
+    traversed in a single pass over a graph of the image pixels, so the cost is linear on the
+    number of pixels with value.
+
+    :param image: the retinal image to extract its vessels
+    :param ignored_pixels: how many pixels will be ignored from borders.
+    :return: a list with a [vessel_x, vessel_y] pair of numpy arrays per vessel
+    """
+    pixels = image.np_image > 0
+    labels, _ = ndimage.label(pixels, structure=np.ones([3, 3]))
+
+    # vessels start at their first pixel outside the border, in row order
+    inner = labels[
+        ignored_pixels:image.shape[0] - ignored_pixels,
+        ignored_pixels:image.shape[1] - ignored_pixels]
+    inner_x, inner_y = np.nonzero(inner)
+    vessel_labels, first = np.unique(inner[inner_x, inner_y], return_index=True)
+    first = np.sort(first)
+    if first.size == 0:
+        return []
+    vessel_labels = inner[inner_x[first], inner_y[first]]
+
+    # neighbours are visited in row order, the same order of the pixel by pixel traversal
+    node_x, node_y, graph = pixel_graph(
+        pixels, inner_x[first] + ignored_pixels, inner_y[first] + ignored_pixels)
+    order = csgraph.breadth_first_order(
+        graph, node_x.size, directed=True, return_predecessors=False)[1:]
+
+    # vessels are kept in the order of their starting pixel
+    vessel_order = np.zeros(labels.max() + 1, dtype=np.intp)
+    vessel_order[vessel_labels] = np.arange(vessel_labels.size)
+    order_x = node_x[order]
+    order_y = node_y[order]
+    order_vessel = vessel_order[labels[order_x, order_y]]
+    # sort by vessel, then x, then traversal order and keep the first pixel of each x
+    sorted_ids = np.lexsort((np.arange(order.size), order_x, order_vessel))
+    order_x = order_x[sorted_ids]
+    order_y = order_y[sorted_ids]
+    order_vessel = order_vessel[sorted_ids]
+    keep = np.ones(order.size, dtype=bool)
+    keep[1:] = (order_x[1:] != order_x[:-1]) | (order_vessel[1:] != order_vessel[:-1])
+    order_x = order_x[keep]
+    order_y = order_y[keep]
+    splits = np.flatnonzero(np.diff(order_vessel[keep])) + 1
+    return [
+        [vessel_x, vessel_y]
+        for vessel_x, vessel_y in zip(np.split(order_x, splits), np.split(order_y, splits))]
+
+
 def detect_vessel_border(image: Retina, ignored_pixels=1):
     """
     Extracts the vessel border of the given image, this method will try to extract all vessel
@@ -447,82 +563,6 @@ def detect_vessel_border(image: Retina, ignored_pixels=1):
     :param image: the retinal image to extract its vessels
     :param ignored_pixels: how many pixels will be ignored from borders.
     """
-
-    def neighbours(pixel, window):  # pragma: no cover
-        """
-        Creates a list of the neighbouring pixels for the given one. It will only
-        add to the list if the pixel has value.
-
-        :param pixel: the pixel position to extract its neighbours
-        :param window:  the window with the pixels information
-        :return: a list of pixels (list of tuples)
-        """
-        x_less = max(0, pixel[0] - 1)
-        y_less = max(0, pixel[1] - 1)
-        x_more = min(window.shape[0] - 1, pixel[0] + 1)
-        y_more = min(window.shape[1] - 1, pixel[1] + 1)
-
-        active_neighbours = []
-
-        if window.np_image[x_less, y_less] > 0:
-            active_neighbours.append([x_less, y_less])
-        if window.np_image[x_less, pixel[1]] > 0:
-            active_neighbours.append([x_less, pixel[1]])
-        if window.np_image[x_less, y_more] > 0:
-            active_neighbours.append([x_less, y_more])
-        if window.np_image[pixel[0], y_less] > 0:
-            active_neighbours.append([pixel[0], y_less])
-        if window.np_image[pixel[0], y_more] > 0:
-            active_neighbours.append([pixel[0], y_more])
-        if window.np_image[x_more, y_less] > 0:
-            active_neighbours.append([x_more, y_less])
-        if window.np_image[x_more, pixel[1]] > 0:
-            active_neighbours.append([x_more, pixel[1]])
-        if window.np_image[x_more, y_more] > 0:
-            active_neighbours.append([x_more, y_more])
-
-        return active_neighbours
-
-    def vessel_extractor(window, start_x, start_y):
-        """
-        Extracts a vessel using adjacent points, when each point is extracted is deleted from the
-        original image
-        """
-        vessel = []
-        pending_pixels = [[start_x, start_y]]
-        while pending_pixels:
-            pixel = pending_pixels.pop(0)
-            if window.np_image[pixel[0], pixel[1]] > 0:
-                vessel.append(pixel)
-                window.np_image[pixel[0], pixel[1]] = 0
-
-                # add the neighbours with value to pending list:
-                pending_pixels.extend(neighbours(pixel, window))
-
-        # sort by x position
-        vessel.sort(key=lambda item: item[0])
-
-        # remove all repeating x values
-        current_x = -1
-        filtered_vessel = []
-        for pixel in vessel:
-            if pixel[0] == current_x:
-                pass
-            else:
-                filtered_vessel.append(pixel)
-                current_x = pixel[0]
-
-        vessel_x = []
-        vessel_y = []
-        for pixel in filtered_vessel:
-            vessel_x.append(pixel[0])
-            vessel_y.append(pixel[1])
-        return [vessel_x, vessel_y]
-
-    vessels = []
-    for it_x in range(ignored_pixels, image.shape[0] - ignored_pixels):
-        for it_y in range(ignored_pixels, image.shape[1] - ignored_pixels):
-            if image.np_image[it_x, it_y] > 0:
-                vessel = vessel_extractor(image, it_x, it_y)
-                vessels.append(vessel)
-    return vessels
+    return [
+        [vessel_x.tolist(), vessel_y.tolist()]
+        for vessel_x, vessel_y in detect_vessels(image, ignored_pixels)]
@@ -17,7 +17,9 @@
 """retina module to handle basic image processing on retinal images"""
 
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
+import time
 import numpy as np
 import cv2
 from scipy import ndimage
@@ -63,8 +65,9 @@ class Retina_grayscale(object):
         self.shape = self.np_image.shape
         self.original_image = self.np_image
         self.segmented = False
-        self.segmented_image = np.zeros((self.shape))
+        self.segmented_image = np.zeros(self.shape, np.uint8)
         self.roc = np.zeros((1,5)).astype(np.float)
+        self.timings = {}
 
         if image_type == 0:
             if self.shape[0] <= 1020 and self.shape[1] <= 1020:
@@ -105,7 +108,7 @@ class Retina_grayscale(object):
             self.smoothing_curves_iterations = 2
             self.smoothing_curves_kernel = 3
 
-        self.mask = abs(1 - self.mask)
+        self.mask = (1 - self.mask).astype(np.uint8)
 
 ##################################################################################################
 # Image Processing functions
@@ -118,9 +121,14 @@ class Retina_grayscale(object):
     def equalize_histogram(self):
         """Applies contrast limited adaptive histogram equalization algorithm (CLAHE)"""
         self._copy()
+        self.np_image = self._equalized(self.np_image)
+
+    def _equalized(self, image: np.ndarray):
+        """CLAHE of the given image with the mask restored, without changing the stored one"""
         clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(3, 3))
-        self.np_image = clahe.apply(self.np_image)
-        self.restore_mask()
+        equalized = clahe.apply(image)
+        equalized[self.mask == 0] = 0
+        return equalized
 
     def opening(self, size_structure):
         """
@@ -176,43 +184,66 @@ class Retina_grayscale(object):
         original image and finally the values obtained from the subtraction are moved to the 256 possible grayscale values"""
 
         self._copy()
-        minuendo = np.copy(self.np_image)
-        self.mean_filter(self.kernel_mean_filter)
-        self.gaussian_filter(self.kernel_gaussian_filter, 1.82)
-        self.mean_value = np.mean(self.np_image)
-        self.np_image[self.mask] = self.mean_value
-        self.median_filter(self.kernel_median_filter)#Ver si es posible aumentarlo en otro pc
-        self.np_image = minuendo - self.np_image.astype(np.float)
-        min = self.np_image.min()
-        self.np_image = self.np_image - min
-        max = self.np_image.max()
-        escala = float(255) / (max)
-        for row in range(0, self.shape[0]):
-            for col in range(0, self.shape[1]):
-                self.np_image[row, col] = int(self.np_image[row, col] * escala)
-        self.restore_mask()
+        self.np_image, self.mean_value = self._shadow_corrected(self.np_image)
+
+    def _shadow_corrected(self, image: np.ndarray):
+        """
+        Shadow correction of the given image, without changing the stored one.
+        :return: the corrected image and the mean value of the filtered image
+        """
+        background = cv2.blur(image, (self.kernel_mean_filter, self.kernel_mean_filter))
+        background = cv2.GaussianBlur(background, (self.kernel_gaussian_filter, self.kernel_gaussian_filter), 1.82)
+        mean_value = np.mean(background)
+        background[self.mask] = mean_value
+        background = cv2.medianBlur(background.astype(np.uint8), self.kernel_median_filter)#Ver si es posible aumentarlo en otro pc
+        if np.issubdtype(image.dtype, np.integer):
+            image = image.astype(np.int32)
+        corrected = self._rescale(image - background)
+        corrected[self.mask == 0] = 0
+        return corrected, mean_value
+
+    @staticmethod
+    def _rescale(image: np.ndarray):
+        """
+        Moves the values of the given image to the 0-255 range, truncating every scaled value as int()
+        does. Integer images return an uint8 image, the scaling product is done in float64 so the
+        truncation happens at the same values as the per pixel implementation.
+        """
+        image = image - image.min()
+        escala = float(255) / (image.max())
+        if np.issubdtype(image.dtype, np.integer):
+            return np.multiply(image, escala, dtype=np.float64).astype(np.uint8)
+        return np.trunc(image * escala)
 
     def homogenize(self):
         """Moves all the values resulting from the correction of the shadows to the possible 255 values"""
         self._copy()
-        g_input_max = self.np_image.max()
-        aux = np.zeros(self.shape)
-        for row in range(0, self.shape[0]):
-            for col in range(0, self.shape[1]):
-                g = self.np_image[row, col] + 180 - g_input_max
-                if (g < 0):
-                    aux[row, col] = 0
-                elif (g > 255): # pragma: no cover
-                    aux[row, col] = 255
-                else:
-                    aux[row, col] = g
-        self.np_image = aux
-        self.IH = np.copy(aux)
+        self.np_image = self._homogenized(self.np_image)
+        self.IH = np.copy(self.np_image)
+
+    @staticmethod
+    def _homogenized(image: np.ndarray):
+        """Homogenization of the given image, integer images return an uint8 image"""
+        g_input_max = image.max()
+        if np.issubdtype(image.dtype, np.integer):
+            return np.clip(image.astype(np.int32) + (180 - int(g_input_max)), 0, 255).astype(np.uint8)
+        return np.clip(image + 180 - g_input_max, 0, 255)
+
+    @staticmethod
+    def _smoothed(homogenized: np.ndarray):
+        """
+        Returns the homogenized image after a 3x3 Gaussian filter, truncated to uint8. The filter runs
+        in float64, in float32 the truncation moves some pixels across the segmentation thresholds.
+        """
+        return cv2.GaussianBlur(homogenized.astype(np.float64), (3, 3), 1.72).astype(np.uint8)
 
     def normal_vessels_segmentation(self):
         self.shadow_correction()
         self.homogenize()
-        IH = cv2.GaussianBlur(self.IH, (3, 3), 1.72).astype(np.uint8)
+        return self._normal_vessels(self.IH)
+
+    def _normal_vessels(self, homogenized: np.ndarray):
+        IH = self._smoothed(homogenized)
         ret, normal_vessels_segmentation = cv2.threshold(IH, 0, 255, cv2.THRESH_OTSU)
         npaContours, hierarchy = cv2.findContours(normal_vessels_segmentation, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
         for npaContour in npaContours:
@@ -220,13 +251,15 @@ class Retina_grayscale(object):
                 cv2.drawContours(normal_vessels_segmentation, [npaContour], -1, (255, 255, 255), -1)
         return abs(255 - normal_vessels_segmentation)
 
-
     def tiny_vessels_segmentation(self):
         self.equalize_histogram()
         self.opening(self.kernel_opening)
         self.shadow_correction()
         self.homogenize()
-        IH = cv2.GaussianBlur(self.IH, (3, 3), 1.72).astype(np.uint8)
+        return self._tiny_vessels(self.IH)
+
+    def _tiny_vessels(self, homogenized: np.ndarray):
+        IH = self._smoothed(homogenized)
 
         tiny_vessels_segmentation = cv2.adaptiveThreshold(IH, 255, self.main_adaptative_method, cv2.THRESH_BINARY, self.tiny_vessels_threshold, 2)#13
 
@@ -277,17 +310,50 @@ class Retina_grayscale(object):
         final_vessels_segmentation = cv2.erode(final_vessels_segmentation, kernel, iterations=1)
         return final_vessels_segmentation
 
+    def _timed(self, stage: str, function, *args):
+        """Calls the given function and stores how long it took, in seconds, in timings[stage]"""
+        start = time.perf_counter()
+        result = function(*args)
+        self.timings[stage] = time.perf_counter() - start
+        return result
+
+    def _normal_vessels_branch(self, image: np.ndarray):
+        corrected, _ = self._timed("normal_shadow_correction", self._shadow_corrected, image)
+        homogenized = self._timed("normal_homogenize", self._homogenized, corrected)
+        return self._timed("normal_segmentation", self._normal_vessels, homogenized)
+
+    def _tiny_vessels_branch(self, image: np.ndarray):
+        equalized = self._timed("tiny_equalize_histogram", self._equalized, image)
+        opened = self._timed(
+            "tiny_opening", ndimage.grey_opening, equalized, (self.kernel_opening, self.kernel_opening))
+        corrected, mean_value = self._timed("tiny_shadow_correction", self._shadow_corrected, opened)
+        homogenized = self._timed("tiny_homogenize", self._homogenized, corrected)
+        return self._timed("tiny_segmentation", self._tiny_vessels, homogenized), homogenized, mean_value
+
     def double_segmentation(self):
-        normal_vessels_segmentation = self.normal_vessels_segmentation()
-        self.np_image = self.original_image
-        tiny_vessels_segmentation = self.tiny_vessels_segmentation()
-        final_vessels_segmentation = tiny_vessels_segmentation.astype(np.float) + normal_vessels_segmentation.astype(np.float)
-        k = final_vessels_segmentation >= 1
-        final_vessels_segmentation[k] = 255
-        k2 = final_vessels_segmentation <= 0
-        final_vessels_segmentation[k2] = 0
-
-        final_vessels_segmentation = self.post_processing(final_vessels_segmentation)
+        """
+        Segments the vessels combining the normal and tiny vessels segmentations. Both branches start
+        from their own copy of the green channel and run concurrently, OpenCV releases the GIL during
+        the filters. The time spent on each stage is stored in timings.
+        :return: the segmented image as a base64 png
+        """
+        self.timings = {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            normal = executor.submit(self._normal_vessels_branch, self.np_image)
+            tiny = executor.submit(self._tiny_vessels_branch, self.original_image)
+            normal_vessels_segmentation = normal.result()
+            tiny_vessels_segmentation, homogenized, self.mean_value = tiny.result()
+        self._copy()
+        self.np_image = homogenized
+        self.IH = np.copy(homogenized)
+        self.timings["branches"] = time.perf_counter() - start
+
+        final_vessels_segmentation = np.zeros(self.shape, np.uint8)
+        final_vessels_segmentation[(tiny_vessels_segmentation != 0) | (normal_vessels_segmentation != 0)] = 255
+
+        final_vessels_segmentation = self._timed("post_processing", self.post_processing, final_vessels_segmentation)
+        self.timings["total"] = time.perf_counter() - start
         return self.get_base64_image(final_vessels_segmentation)
 
     def calculate_roc(self, image, result):
@@ -20,7 +20,13 @@ tortuosity_measures
 """
 
 import numpy as np
-from retipy import retina, tortuosity_measures
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from retipy import landmarks, retina, tortuosity_measures
+from scipy import ndimage
+from scipy.sparse import csgraph
+
+_EXECUTORS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
 
 
 def _tortuosity_window(x1: int, y1: int, x2: int, y2: int, notes: str):
@@ -31,12 +37,176 @@ def _tortuosity_window(x1: int, y1: int, x2: int, y2: int, notes: str):
     return tw
 
 
+def _detect_window_vessels(windows: np.ndarray, min_pixels: int, name: str):
+    """
+    Extracts the vessels longer than min_pixels of each of the given window images.
+    :param windows: a [n, width, height] array with the window images
+    :param min_pixels: the minimum pixel count of the vessels to keep
+    :param name: the name given to the window images
+    :return: a list with the vessels of each window
+    """
+    return [
+        [vessel for vessel in retina.detect_vessels(retina.Retina(window, name)) if len(vessel[0]) > min_pixels]
+        for window in windows]
+
+
+def _window_vessels(
+        windows: retina.Window, min_pixels: int, name: str, workers: int = 1, executor: str = "thread"):
+    """
+    Extracts the vessels longer than min_pixels of every window.
+
+    The windows are extracted serially by default. Using several workers is an opt-in for machines
+    with more than one core: the windows are split in one contiguous chunk per worker, so each
+    window is pickled once for a process pool, and the chunks are joined back in window order. On a
+    single core the pools are not faster, and the process pool pays for starting its workers.
+    :param windows: the windows of the image
+    :param min_pixels: the minimum pixel count of the vessels to keep
+    :param name: the name given to the window images
+    :param workers: how many threads or processes extract the vessels, 1 to extract them serially
+    :param executor: "thread" or "process", the kind of pool used when workers > 1
+    :return: the vessels, in window order, and the window of each one
+    """
+    if executor not in _EXECUTORS:
+        raise ValueError("unknown executor '{}', expected one of {}".format(executor, sorted(_EXECUTORS)))
+    images = windows.windows[:, 0]
+    if workers > 1:
+        chunks = np.array_split(images, min(workers, images.shape[0]))
+        with _EXECUTORS[executor](max_workers=workers) as pool:
+            window_vessels = [
+                vessels
+                for chunk in pool.map(
+                    _detect_window_vessels, chunks, repeat(min_pixels), repeat(name))
+                for vessels in chunk]
+    else:
+        window_vessels = _detect_window_vessels(images, min_pixels, name)
+
+    vessels = []
+    vessel_windows = []
+    for i, current in enumerate(window_vessels):
+        vessels.extend(current)
+        vessel_windows.extend([i] * len(current))
+    return vessels, vessel_windows
+
+
+def _trace_segments(pixels: np.ndarray):
+    """
+    Traces the 8-connected pieces of the given image, where no pixel has more than two neighbours,
+    as ordered paths. Each piece starts at its first end in row order, or at its first pixel when it
+    is a closed loop.
+    :param pixels: a boolean image
+    :return: a list with a [segment_x, segment_y] pair of numpy arrays per piece, in the order of
+             their starting pixels
+    """
+    labels, _ = ndimage.label(pixels, structure=np.ones([3, 3]))
+    node_x, node_y = np.nonzero(pixels)
+    node_count = node_x.size
+    if not node_count:
+        return []
+
+    # the first end of each piece, the pixels with at most one neighbour (the 3x3 sum counts the
+    # pixel too), loops have none and start at their first pixel
+    node_labels = labels[node_x, node_y]
+    neighbours = ndimage.convolve(pixels.astype(np.uint8), np.ones([3, 3], dtype=np.uint8), mode="constant")
+    ends = np.flatnonzero(neighbours[node_x, node_y] <= 2)
+    first_end = np.full(node_labels.max() + 1, node_count, dtype=np.intp)
+    np.minimum.at(first_end, node_labels[ends], ends)
+    first_pixel = np.full(node_labels.max() + 1, node_count, dtype=np.intp)
+    np.minimum.at(first_pixel, node_labels, np.arange(node_count))
+    starts = np.sort(np.where(first_end < node_count, first_end, first_pixel)[1:])
+
+    # a depth first traversal from the root walks each piece from end to end
+    _, _, graph = retina.pixel_graph(pixels, node_x[starts], node_y[starts])
+    order = csgraph.depth_first_order(graph, node_count, directed=True, return_predecessors=False)[1:]
+    splits = np.flatnonzero(np.diff(node_labels[order])) + 1
+    return [
+        [segment_x, segment_y]
+        for segment_x, segment_y in zip(np.split(node_x[order], splits), np.split(node_y[order], splits))]
+
+
+def _image_vessels(image: retina.Retina, windows: retina.Window, min_pixels: int):
+    """
+    Extracts the vessel segments longer than min_pixels of the whole image in a single pass, so
+    vessels that cross the border of a window are not split by it. The skeleton is split at its
+    branch and crossing pixels, the ones with three or more neighbours, and each remaining piece is
+    traced as an ordered path. Each segment is assigned to the first window that contains its
+    middle point, segments outside every window are dropped.
+    :param image: the skeleton of the image
+    :param windows: the windows of the image
+    :param min_pixels: the minimum pixel count of the segments to keep
+    :return: the segments, in window order, and the window of each one
+    """
+    # the first window that contains each pixel, filled backwards so the first one is kept
+    owner = np.full(image.np_image.shape[:2], -1, dtype=np.intp)
+    for i in range(windows.shape[0] - 1, -1, -1):
+        w_pos = windows.w_pos[i]
+        owner[w_pos[0, 0]:w_pos[1, 0], w_pos[0, 1]:w_pos[1, 1]] = i
+
+    # padded so the pixels on the border of the image are checked too
+    skeleton = np.pad((image.np_image > 0).astype(np.uint8), 1)
+    _, segments = landmarks.potential_landmarks(skeleton, 3)
+    vessels = [
+        vessel for vessel in _trace_segments(segments[1:-1, 1:-1] > 0) if len(vessel[0]) > min_pixels]
+    vessel_windows = [
+        owner[vessel[0][len(vessel[0]) // 2], vessel[1][len(vessel[1]) // 2]] for vessel in vessels]
+    assigned = sorted((window_id, i) for i, window_id in enumerate(vessel_windows) if window_id >= 0)
+    return [vessels[i] for _, i in assigned], [window_id for window_id, _ in assigned]
+
+
+def _evaluate(
+        image: retina.Retina,
+        windows: retina.Window,
+        name: str,
+        measure: str,
+        threshold: float,
+        evaluation: dict,
+        extraction: str,
+        workers: int,
+        executor: str):
+    """
+    Evaluates the given measure on the vessels of every window, windows with a vessel above the
+    threshold are added to the evaluation data, once per vessel.
+    :param image: the skeleton of the image
+    :param windows: the windows of the image
+    :param name: the name given to the window images
+    :param measure: the name of the measure, from tortuosity_measures.MEASURES
+    :param threshold: the minimum value of the measure to report a window
+    :param evaluation: the evaluation to fill
+    :param extraction: "window" to extract the vessels of each window on its own, or "image" to
+                       extract them once from the whole image and assign them to the windows
+    :param workers: how many threads or processes extract the vessels of the windows, 1 (the
+                    default of density and fractal) to extract them serially
+    :param executor: "thread" or "process", the kind of pool used when workers > 1
+    :return: the given evaluation
+    """
+    if extraction == "window":
+        vessels, vessel_windows = _window_vessels(windows, 10, name, workers, executor)
+    elif extraction == "image":
+        vessels, vessel_windows = _image_vessels(image, windows, 10)
+    else:
+        raise ValueError("unknown extraction '{}', expected 'window' or 'image'".format(extraction))
+    values = tortuosity_measures.evaluate_vessels(
+        *tortuosity_measures.vessel_coordinates(vessels), measures=(measure,))[measure]
+    for window_id, value in zip(vessel_windows, values):
+        if value > threshold:
+            w_pos = windows.w_pos[window_id]
+            evaluation["data"].append(_tortuosity_window(
+                w_pos[0, 0].item(),
+                w_pos[0, 1].item(),
+                w_pos[1, 0].item(),
+                w_pos[1, 1].item(),
+                "{0:.2f}".format(value)))
+    return evaluation
+
+
 def density(
         image: np.ndarray,
         window_size: int = 10,
         min_pixels: int = 10,
         creation_method: str = "separated",
-        threshold: float = 0.97) -> dict:
+        threshold: float = 0.97,
+        extraction: str = "window",
+        workers: int = 1,
+        executor: str = "thread") -> dict:
     image = retina.Retina(image, "tortuosity_density")
     dimension = image.reshape_by_window(window_size, True)
     image.threshold_image()
@@ -49,26 +219,7 @@ def density(
             # "image": image.original_base64  # TODO: maybe return a processed image?
         }
 
-    for i in range(0, windows.shape[0]):
-        window = windows.windows[i, 0]
-        w_pos = windows.w_pos[i]
-        image = retina.Retina(window, "td")
-
-        vessels = retina.detect_vessel_border(image)
-        processed_vessel_count = 0
-        for vessel in vessels:
-            if len(vessel[0]) > 10:
-                processed_vessel_count += 1
-                tortuosity_density = tortuosity_measures.tortuosity_density(vessel[0], vessel[1])
-                if tortuosity_density > threshold:
-                    evaluation["data"].append(_tortuosity_window(
-                        w_pos[0, 0].item(),
-                        w_pos[0, 1].item(),
-                        w_pos[1, 0].item(),
-                        w_pos[1, 1].item(),
-                        "{0:.2f}".format(tortuosity_density)))
-
-    return evaluation
+    return _evaluate(image, windows, "td", "density", threshold, evaluation, extraction, workers, executor)
 
 
 def fractal(
@@ -76,7 +227,10 @@ def fractal(
         window_size: int = 10,
         min_pixels: int = 56,
         creation_method: str = "separated",
-        threshold: float = 0.94) -> dict:
+        threshold: float = 0.94,
+        extraction: str = "window",
+        workers: int = 1,
+        executor: str = "thread") -> dict:
     image = retina.Retina(image, "tortuosity_density")
     dimension = image.reshape_by_window(window_size, True)
     image.threshold_image()
@@ -89,22 +243,4 @@ def fractal(
             # "image": image.original_base64  # TODO: maybe return a processed image?
         }
 
-    for i in range(0, windows.shape[0]):
-        window = windows.windows[i, 0]
-        w_pos = windows.w_pos[i]
-        image = retina.Retina(window, "tf")
-        vessels = retina.detect_vessel_border(image)
-        processed_vessel_count = 0
-        for vessel in vessels:
-            if len(vessel[0]) > 10:
-                processed_vessel_count += 1
-                fractal_tortuosity = tortuosity_measures.fractal_tortuosity_curve(vessel[0], vessel[1])
-                if fractal_tortuosity > threshold:
-                    evaluation["data"].append(_tortuosity_window(
-                        w_pos[0, 0].item(),
-                        w_pos[0, 1].item(),
-                        w_pos[1, 0].item(),
-                        w_pos[1, 1].item(),
-                        "{0:.2f}".format(fractal_tortuosity)))
-
-    return evaluation
+    return _evaluate(image, windows, "tf", "fractal", threshold, evaluation, extraction, workers, executor)
@@ -36,6 +36,29 @@ def _distance_2p(x1, y1, x2, y2):
     return ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5
 
 
+def _segment_lengths(x, y):
+    """
+    calculates the distance between every pair of consecutive points of the given curve.
+    :param x: the x component of the curve
+    :param y: the y component of the curve
+    :return: an array with the len(x)-1 segment lengths
+    """
+    return np.hypot(np.diff(x), np.diff(y))
+
+
+def _sequential_sum(values):
+    """
+    adds the given values from the first to the last one, this matches the rounding of a python
+    loop, which np.sum does not as it uses pairwise summation.
+    :param values: an array with the values to add
+    :return: the sum of the values, 0 if there are none
+    """
+    if not len(values):
+        return 0
+    # starting from 0 also turns a -0.0 total into 0.0, as the loop does
+    return 0 + np.cumsum(values)[-1].item()
+
+
 def _curve_length(x, y):
     """
     calculates the length(distance) of the given curve, iterating from point to point.
@@ -43,10 +66,7 @@ def _curve_length(x, y):
     :param y: the y component of the curve
     :return: the curve length
     """
-    distance = 0
-    for i in range(0, len(x) - 1):
-        distance += _distance_2p(x[i], y[i], x[i + 1], y[i + 1])
-    return distance
+    return _sequential_sum(_segment_lengths(x, y))
 
 
 def _chord_length(x, y):
@@ -70,49 +90,24 @@ def _detect_inflection_points(x, y):
     :param y: the y values of the curve
     :return: the array position in x of the inflection points.
     """
-    cf = np.convolve(y, [1, -1])
-    inflection_points = []
-    for iterator in range(2, len(x)):
-        if np.sign(cf[iterator]) != np.sign(cf[iterator - 1]):
-            inflection_points.append(iterator - 1)
-    return inflection_points
-
-
-def _curve_to_image(x, y):
-    # get the maximum and minimum x and y values
-    mm_values = np.empty([2, 2], dtype=np.int)
-    mm_values[0, :] = 99999999999999
-    mm_values[1, :] = -99999999999999
-    for i in range(0, len(x)):
-        if x[i] < mm_values[0, 0]:
-            mm_values[0, 0] = x[i]
-        if x[i] > mm_values[1, 0]:
-            mm_values[1, 0] = x[i]
-        if y[i] < mm_values[0, 1]:
-            mm_values[0, 1] = y[i]
-        if y[i] > mm_values[1, 1]:
-            mm_values[1, 1] = y[i]
-    distance_x = mm_values[1, 0] - mm_values[0, 0]
-    distance_y = mm_values[1, 1] - mm_values[0, 1]
-    # calculate which square with side 2^n of size will contain the line
+    signs = np.sign(np.convolve(y, [1, -1])[1:len(x)])
+    return (np.flatnonzero(signs[1:] != signs[:-1]) + 1).tolist()
+
+
+def _curve_image_dimension(x, y):
+    """
+    Side of the square image used to measure the fractal dimension of the given curve, the smallest
+    power of two that contains the curve, doubled.
+    :param x: the x values of the curve
+    :param y: the y values of the curve
+    :return: the side of the curve image
+    """
+    distance_x = np.max(x) - np.min(x)
+    distance_y = np.max(y) - np.min(y)
     image_dim = 2
     while image_dim < distance_x or image_dim < distance_y:
         image_dim *= 2
-    image_dim *= 2
-    # values to center the
-    padding_x = (mm_values[1, 0] - mm_values[0, 0]) // 2
-    padding_y = (mm_values[1, 1] - mm_values[0, 1]) // 2
-
-    image_curve = np.full([image_dim, image_dim], False)
-
-    for i in range(0, len(x)):
-        x[i] = x[i] - mm_values[0, 0]
-        y[i] = y[i] - mm_values[0, 1]
-
-    for i in range(0, len(x)):
-        image_curve[x[i], y[i]] = True
-
-    return Retina(image_curve, "curve_image")
+    return image_dim * 2
 
 
 def linear_regression_tortuosity(x, y, sampling_size=6, retry=True):
@@ -133,34 +128,28 @@ def linear_regression_tortuosity(x, y, sampling_size=6, retry=True):
     """
     if len(x) < 4:
         raise ValueError("Given curve must have more than 4 elements")
+    x = np.asarray(x)
+    y = np.asarray(y)
     try:
         min_point_x = x[0]
         min_point_y = y[0]
 
-        slope = (y[len(y) - 1] - min_point_y)/(x[len(x) - 1] - min_point_x)
+        run = x[len(x) - 1] - min_point_x
+        if not run:
+            raise ZeroDivisionError("vertical curve")
+        slope = (y[len(y) - 1] - min_point_y)/run
 
         y_intercept = min_point_y - slope*min_point_x
 
         sample_distance = max(round(len(x) / sampling_size), 1)
-
-        # linear regression function
-        def f_y(x1):
-            return x1 * slope + y_intercept
+        samples = slice(1, len(x) - 1, sample_distance)
 
         # calculate y_average
-        y_average = 0
-        item_count = 0
-        for i in range(1, len(x) - 1, sample_distance):
-            y_average += y[i]
-            item_count += 1
-        y_average /= item_count
-
-        # calculate determination coefficient
-        top_sum = 0
-        bottom_sum = 0
-        for i in range(1, len(x) - 1, sample_distance):
-            top_sum += (f_y(x[i]) - y_average) ** 2
-            bottom_sum += (y[i] - y_average) ** 2
+        y_average = _sequential_sum(y[samples]) / len(y[samples])
+
+        # calculate determination coefficient, f(x) = x * slope + y_intercept is the regression line
+        top_sum = _sequential_sum(np.square(x[samples] * slope + y_intercept - y_average))
+        bottom_sum = _sequential_sum(np.square(y[samples] - y_average))
 
         r_2 = top_sum / bottom_sum
     except ZeroDivisionError:
@@ -215,8 +204,17 @@ def fractal_tortuosity(retinal_image: Retina):
 
 
 def fractal_tortuosity_curve(x, y):
-    image = _curve_to_image(x, y)
-    return fractal_dimension.fractal_dimension(image.np_image)
+    """
+    Calculates the fractal dimension of the image of the given curve, moved to the origin. The
+    boxes are counted directly from the curve points, without drawing the image.
+    :param x: the x values of the curve, as integers
+    :param y: the y values of the curve, as integers
+    :return: the fractal dimension of the curve
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    return fractal_dimension.fractal_dimension_points(
+        x - x.min(), y - y.min(), _curve_image_dimension(x, y))
 
 
 def tortuosity_density(x, y):
@@ -232,18 +230,17 @@ def tortuosity_density(x, y):
     n = len(inflection_points)
     if not n:
         return 0
+    segment_lengths = _segment_lengths(x, y)
     starting_position = 0
     sum_segments = 0
     # we process the curve dividing it on its inflection points
     for in_point in inflection_points:
-        segment_x = x[starting_position:in_point]
-        segment_y = y[starting_position:in_point]
-        chord = _chord_length(segment_x, segment_y)
+        chord = _chord_length(x[starting_position:in_point], y[starting_position:in_point])
         if chord:
-            sum_segments += _curve_length(segment_x, segment_y) / _chord_length(segment_x, segment_y) - 1
+            sum_segments += _sequential_sum(segment_lengths[starting_position:in_point - 1]) / chord - 1
         starting_position = in_point
 
-    return (n - 1)/n + (1/_curve_length(x, y))*sum_segments
+    return (n - 1)/n + (1/_sequential_sum(segment_lengths))*sum_segments
 
 
 def squared_curvature_tortuosity(x, y):
@@ -254,15 +251,15 @@ def squared_curvature_tortuosity(x, y):
     :param y: the y values of the curve
     :return: the squared curvature tortuosity of the given curve
     """
-    curvatures = []
-    x_values = range(1, len(x)-1)
-    for i in x_values:
-        x_1 = m.derivative1_centered_h1(i, x)
-        x_2 = m.derivative2_centered_h1(i, x)
-        y_1 = m.derivative1_centered_h1(i, y)
-        y_2 = m.derivative2_centered_h1(i, y)
-        curvatures.append((x_1*y_2 - x_2*y_1)/(y_1**2 + x_1**2)**1.5)
-    return abs(np.trapz(curvatures, x_values))
+    x_1 = m.derivatives1_centered_h1(x)
+    x_2 = m.derivatives2_centered_h1(x)
+    y_1 = m.derivatives1_centered_h1(y)
+    y_2 = m.derivatives2_centered_h1(y)
+    denominator = (np.square(y_1) + np.square(x_1)) ** 1.5
+    if not denominator.all():
+        raise ZeroDivisionError("the curve has repeated points")
+    curvatures = (x_1*y_2 - x_2*y_1)/denominator
+    return abs(np.trapz(curvatures, np.arange(1, len(x)-1)))
 
 
 def smooth_tortuosity_cubic(x, y):
@@ -277,6 +274,243 @@ def smooth_tortuosity_cubic(x, y):
     return spline(x[0])
 
 
+MEASURES = (
+    "linear_regression",
+    "distance_measure",
+    "inflection_count",
+    "squared_curvature",
+    "density",
+    "fractal")
+
+
+def vessel_coordinates(vessels):
+    """
+    Packs a list of vessels in a ragged (CSR like) layout, where the points of vessel i are
+    x[offsets[i]:offsets[i + 1]] and y[offsets[i]:offsets[i + 1]].
+    :param vessels: a list of [vessel_x, vessel_y] pairs, as returned by retina.detect_vessels
+    :return: the x and y arrays with the points of every vessel and the offsets of each vessel
+    """
+    lengths = [len(vessel[0]) for vessel in vessels]
+    offsets = np.zeros(len(vessels) + 1, dtype=np.intp)
+    offsets[1:] = np.cumsum(lengths)
+    if not vessels:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), offsets
+    x = np.concatenate([np.asarray(vessel[0]) for vessel in vessels])
+    y = np.concatenate([np.asarray(vessel[1]) for vessel in vessels])
+    return x, y, offsets
+
+
+def _sequential_range_sums(values, starts, ends):
+    """
+    Adds values[starts[i]:ends[i]] from left to right for every i, same as _sequential_sum does for
+    one range. The ranges are walked together, one position at a time, so the work is proportional
+    to the number of values plus the length of the longest range.
+    :param values: an array with the values
+    :param starts: the first position of each range
+    :param ends: the position after the last one of each range
+    :return: the sum of each range, 0 for the empty ones
+    """
+    values = np.asarray(values)
+    lengths = np.maximum(ends - starts, 0)
+    sums = np.zeros(lengths.size, dtype=values.dtype)
+    if not lengths.size:
+        return sums
+    # from the longest to the shortest, the ranges that reach position k are the first counts[k]
+    order = np.argsort(-lengths, kind="stable")
+    sorted_starts = starts[order]
+    counts = np.searchsorted(-lengths[order], -np.arange(lengths.max()), side="left")
+    sorted_sums = np.zeros(lengths.size, dtype=values.dtype)
+    for k, count in enumerate(counts):
+        sorted_sums[:count] += values[sorted_starts[:count] + k]
+    sums[order] = sorted_sums
+    # starting from 0 also turns a -0.0 total into 0.0, as the loop does
+    return 0 + sums
+
+
+def _vessel_inflection_points(y, ids):
+    """
+    _detect_inflection_points of every vessel
+    :param y: the y points of every vessel
+    :param ids: the vessel of each point
+    :return: the vessel and the position in y of every inflection point, sorted by position
+    """
+    signs = np.sign(np.diff(y))
+    # both slopes around the point must be inside its vessel
+    points = np.flatnonzero((signs[1:] != signs[:-1]) & (ids[:-2] == ids[2:])) + 1
+    return ids[points], points
+
+
+def _vessel_linear_regression(x, y, starts, lengths, sampling_size):
+    """
+    linear_regression_tortuosity of every vessel, vessels where the regression fails are nan
+    """
+    evaluated = lengths >= 4
+    last = np.where(evaluated, starts + lengths - 1, np.minimum(starts, x.size - 1))
+    first = np.where(evaluated, starts, last)
+    run = x[last] - x[first]
+    slope = (y[last] - y[first]) / np.where(run == 0, 1, run)
+    y_intercept = y[first] - slope * x[first]
+
+    # the positions 1, 1 + distance, ... before the last point of every vessel
+    sample_distance = np.maximum(np.round(lengths / sampling_size), 1).astype(np.intp)
+    sample_counts = np.where(evaluated, (lengths - 3) // sample_distance + 1, 0)
+    sample_offsets = np.zeros(lengths.size + 1, dtype=np.intp)
+    sample_offsets[1:] = np.cumsum(sample_counts)
+    vessels = np.repeat(np.arange(lengths.size), sample_counts)
+    samples = starts[vessels] + 1 + \
+        (np.arange(sample_offsets[-1]) - sample_offsets[vessels]) * sample_distance[vessels]
+
+    y_average = _sequential_range_sums(y[samples], sample_offsets[:-1], sample_offsets[1:]) / \
+        np.maximum(sample_counts, 1)
+    top_sum = _sequential_range_sums(
+        np.square(x[samples] * slope[vessels] + y_intercept[vessels] - y_average[vessels]),
+        sample_offsets[:-1], sample_offsets[1:])
+    bottom_sum = _sequential_range_sums(
+        np.square(y[samples] - y_average[vessels]), sample_offsets[:-1], sample_offsets[1:])
+    failed = (run == 0) | (bottom_sum == 0) | ~evaluated
+    r_2 = top_sum / np.where(failed, 1, bottom_sum)
+    r_2[np.isnan(r_2)] = 0
+    r_2[failed] = np.nan
+    return r_2
+
+
+def _vessel_density(x, y, starts, segment_lengths, curve_lengths, inflection_vessels, inflection_points):
+    """
+    tortuosity_density of every vessel, reusing their segment and curve lengths
+    """
+    count = np.bincount(inflection_vessels, minlength=starts.size)
+    # each inflection point closes the curve piece that starts at the previous one
+    first = np.ones(inflection_vessels.size, dtype=bool)
+    first[1:] = inflection_vessels[1:] != inflection_vessels[:-1]
+    piece_starts = np.where(first, starts[inflection_vessels], np.roll(inflection_points, 1))
+    piece_ends = inflection_points - 1
+    piece_lengths = _sequential_range_sums(segment_lengths, piece_starts, piece_ends)
+    chords = np.hypot(x[piece_ends] - x[piece_starts], y[piece_ends] - y[piece_starts])
+    piece_offsets = np.zeros(starts.size + 1, dtype=np.intp)
+    piece_offsets[1:] = np.cumsum(count)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pieces = np.where(chords != 0, piece_lengths / chords - 1, 0)
+        sum_segments = _sequential_range_sums(pieces, piece_offsets[:-1], piece_offsets[1:])
+        density = (count - 1) / count + (1 / curve_lengths) * sum_segments
+    density[count == 0] = 0
+    return density
+
+
+def _vessel_squared_curvature(x, y, lengths, ids):
+    """
+    squared_curvature_tortuosity of every vessel, vessels with repeated points are nan
+    """
+    # the derivatives of the points with both neighbours inside their vessel
+    inside = ids[:-2] == ids[2:]
+    x_1 = m.derivatives1_centered_h1(x)[inside]
+    x_2 = m.derivatives2_centered_h1(x)[inside]
+    y_1 = m.derivatives1_centered_h1(y)[inside]
+    y_2 = m.derivatives2_centered_h1(y)[inside]
+    denominator = (np.square(y_1) + np.square(x_1)) ** 1.5
+    with np.errstate(divide="ignore", invalid="ignore"):
+        curvatures = (x_1*y_2 - x_2*y_1)/denominator
+    offsets = np.zeros(lengths.size + 1, dtype=np.intp)
+    offsets[1:] = np.cumsum(np.maximum(lengths - 2, 0))
+    # the trapezoids between consecutive curvatures, the ones across two vessels are not added
+    areas = (curvatures[1:] + curvatures[:-1]) / 2
+    result = np.abs(_sequential_range_sums(areas, offsets[:-1], offsets[1:] - 1))
+    result[np.bincount(ids[1:-1][inside][denominator == 0], minlength=lengths.size) > 0] = np.nan
+    return result
+
+
+def _vessel_fractal(x, y, starts, lengths, ids):
+    """
+    fractal_tortuosity_curve of every vessel, empty vessels are nan
+    """
+    present = lengths > 0
+    first = starts[present]
+    min_x = np.zeros(lengths.size, dtype=x.dtype)
+    min_y = np.zeros(lengths.size, dtype=y.dtype)
+    min_x[present] = np.minimum.reduceat(x, first)
+    min_y[present] = np.minimum.reduceat(y, first)
+    distance = np.zeros(lengths.size, dtype=np.result_type(x, y))
+    distance[present] = np.maximum(
+        np.maximum.reduceat(x, first) - min_x[present], np.maximum.reduceat(y, first) - min_y[present])
+    # the smallest power of two from 2 that is not less than the distance, as _curve_image_dimension
+    mantissa, exponent = np.frexp(np.maximum(distance, 2))
+    image_dimension = np.left_shift(1, exponent - (mantissa == 0.5))
+    return fractal_dimension.fractal_dimension_point_sets(
+        x - min_x[ids], y - min_y[ids], ids, image_dimension * 2)
+
+
+def evaluate_vessels(x, y, offsets, measures=MEASURES, sampling_size=6):
+    """
+    Calculates the tortuosity measures of many vessels at once. The points of every vessel are
+    processed together, without padding, and the values shared between measures, as the segment
+    lengths and the inflection points, are only calculated when a requested measure needs them.
+    Each measure gives the same value than its single curve function.
+
+    Vessels where a measure is not defined (too short, or repeated points) get nan in it, except for
+    the linear regression that keeps the fallback of linear_regression_tortuosity.
+    :param x: the x points of every vessel, as returned by vessel_coordinates
+    :param y: the y points of every vessel, as returned by vessel_coordinates
+    :param offsets: the offsets of each vessel in x and y
+    :param measures: the names of the measures to calculate, from MEASURES
+    :param sampling_size: the sampling size of the linear regression tortuosity
+    :return: a structured array with a field per measure and a row per vessel
+    """
+    unknown = set(measures) - set(MEASURES)
+    if unknown:
+        raise ValueError("unknown tortuosity measures {}".format(sorted(unknown)))
+    x = np.asarray(x)
+    y = np.asarray(y)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    lengths = np.diff(offsets)
+    result = np.zeros(lengths.size, dtype=[(measure, np.float64) for measure in measures])
+    if not lengths.size:
+        return result
+    if not x.size:
+        for measure in measures:
+            result[measure] = np.nan
+        return result
+
+    starts = offsets[:-1]
+    ids = np.repeat(np.arange(lengths.size), lengths)
+    measures = set(measures)
+    if measures & {"distance_measure", "inflection_count", "density"}:
+        segment_lengths = _segment_lengths(x, y)
+        curve_lengths = _sequential_range_sums(segment_lengths, starts, offsets[1:] - 1)
+    if measures & {"inflection_count", "density"}:
+        inflection_vessels, inflection_points = _vessel_inflection_points(y, ids)
+    if measures & {"distance_measure", "inflection_count"}:
+        first = np.minimum(starts, x.size - 1)
+        last = np.maximum(offsets[1:] - 1, first)
+        chord_lengths = np.hypot(x[last] - x[first], y[last] - y[first])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distance_measure = curve_lengths / chord_lengths
+        distance_measure[lengths < 2] = np.nan
+
+    if "linear_regression" in measures:
+        result["linear_regression"] = _vessel_linear_regression(x, y, starts, lengths, sampling_size)
+        retry = np.flatnonzero(np.isnan(result["linear_regression"]) & (lengths >= 4))
+        if retry.size:
+            # as linear_regression_tortuosity, the failed vessels are tried again with x and y
+            # inverted and the default sampling size, and are not tortuous if that fails too
+            retry_offsets = np.zeros(retry.size + 1, dtype=np.intp)
+            retry_offsets[1:] = np.cumsum(lengths[retry])
+            points = np.repeat(starts[retry] - retry_offsets[:-1], lengths[retry]) + np.arange(retry_offsets[-1])
+            r_2 = _vessel_linear_regression(y[points], x[points], retry_offsets[:-1], lengths[retry], 6)
+            result["linear_regression"][retry] = np.where(np.isnan(r_2), 1, r_2)
+    if "distance_measure" in measures:
+        result["distance_measure"] = distance_measure
+    if "inflection_count" in measures:
+        result["inflection_count"] = \
+            distance_measure * (np.bincount(inflection_vessels, minlength=lengths.size) + 1)
+    if "squared_curvature" in measures:
+        result["squared_curvature"] = _vessel_squared_curvature(x, y, lengths, ids)
+    if "density" in measures:
+        result["density"] = _vessel_density(
+            x, y, starts, segment_lengths, curve_lengths, inflection_vessels, inflection_points)
+    if "fractal" in measures:
+        result["fractal"] = _vessel_fractal(x, y, starts, lengths, ids)
+    return result
+
+
 def evaluate_window(window: Window, min_pixels_per_vessel=6, sampling_size=6, r2_threshold=0.80):  # pragma: no cover
     """
     Evaluates a Window object and sets the tortuosity values in the tag parameter.
@@ -288,29 +522,23 @@ def evaluate_window(window: Window, min_pixels_per_vessel=6, sampling_size=6, r2
     tags = np.empty([window.shape[0], 7])
     # preemptively switch to pytorch.
     window.mode = window.mode_pytorch
-    tft = fractal_tortuosity(window)
+    # the fractal dimension of every window at once
+    tft = fractal_dimension.fractal_dimension(window.windows[:, 0])
     for i in range(0, window.shape[0], 1):
         bw_window = window.windows[i, 0, :, :]
         retina = Retina(bw_window, "window{}" + window.filename)
         retina.threshold_image()
         retina.apply_thinning()
-        vessels = detect_vessel_border(retina)
-        vessel_count = 0
+        vessels = [vessel for vessel in detect_vessel_border(retina) if len(vessel[0]) > min_pixels_per_vessel]
+        vessel_count = len(vessels)
         t1, t2, t3, t4, td, tfi = 0, 0, 0, 0, 0, 0
-        for vessel in vessels:
-            if len(vessel[0]) > min_pixels_per_vessel:
-                vessel_count += 1
-                if linear_regression_tortuosity(vessel[0], vessel[1], sampling_size) > r2_threshold:
-                    t1 += 1
-                t2 += distance_measure_tortuosity(vessel[0], vessel[1])
-                t3 += distance_inflection_count_tortuosity(vessel[0], vessel[1])
-                t4 += squared_curvature_tortuosity(vessel[0], vessel[1])
-                td += tortuosity_density(vessel[0], vessel[1])
-                tfi += fractal_tortuosity_curve(vessel[0], vessel[1])
         if vessel_count > 0:
-            t1 = t1/vessel_count
-            t2 = t2/vessel_count
-            t3 = t3/vessel_count
-            td = td/vessel_count
-        tags[i] = t1, t2, t3, t4, td, tfi, tft
+            measures = evaluate_vessels(*vessel_coordinates(vessels), sampling_size=sampling_size)
+            t1 = np.count_nonzero(measures["linear_regression"] > r2_threshold)/vessel_count
+            t2 = _sequential_sum(measures["distance_measure"])/vessel_count
+            t3 = _sequential_sum(measures["inflection_count"])/vessel_count
+            t4 = _sequential_sum(measures["squared_curvature"])
+            td = _sequential_sum(measures["density"])/vessel_count
+            tfi = _sequential_sum(measures["fractal"])
+        tags[i] = t1, t2, t3, t4, td, tfi, tft[i]
     window.tags = tags
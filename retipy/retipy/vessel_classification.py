@@ -3,62 +3,70 @@ import cv2
 import h5py
 import glob
 import os
+import contextlib
+import threading
+import tensorflow as tf
 from keras.models import model_from_json
 from retipy import retina
 from retipy import landmarks as l
+from retipy import vessel_width as vw
 
 """Module with operations related to classify vessels into arteries and veins."""
 
 _base_directory_training = 'retipy/resources/images/drive/training/'
 _base_directory_test = 'retipy/resources/images/drive/test/'
 _base_directory_model = os.path.join(os.path.dirname(__file__), 'model/')
+_model_name = 'modelVA'
+_models = {}
+_models_lock = threading.Lock()
+_graphs = {}
+_predict_locks = {}
+_predict_batch_size = 1024
+
+
+def load_model(name: str = _model_name):
+    """
+    Returns the neural network stored as <name>.json and <name>.h5 in the model directory. The
+    network is read from disk only the first time it is requested, later calls (from any thread)
+    reuse the same instance.
+    :param name: the file name of the model, without extension
+    :return: the keras model with its weights loaded
+    """
+    model = _models.get(name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(name)
+            if model is None:
+                with open(_base_directory_model + name + '.json', "r") as json_file:
+                    model = model_from_json(json_file.read())
+                model.load_weights(_base_directory_model + name + '.h5')
+                # on graph mode backends the model only exists in the graph it was loaded in
+                _graphs[name] = None if tf.executing_eagerly() else tf.compat.v1.get_default_graph()
+                _predict_locks[name] = threading.Lock()
+                _models[name] = model
+    return model
+
+
+def predict(data: np.ndarray, name: str = _model_name, batch_size: int = _predict_batch_size):
+    """
+    Runs the given network, from any thread. Keras models are not thread safe, so the predictions of
+    each model are serialized, predictions of different models run at the same time, and they run
+    in the graph the model was loaded in.
+    :param data: the input of the network, one row per sample
+    :param name: the file name of the model, without extension
+    :param batch_size: number of samples per batch
+    :return: the predictions of the network
+    """
+    model = load_model(name)
+    graph = _graphs[name]
+    with _predict_locks[name], graph.as_default() if graph is not None else contextlib.ExitStack():
+        return model.predict(data, batch_size=batch_size)
 
 
 def _vessel_widths(center_img: np.ndarray, segmented_img: np.ndarray):
-    image = segmented_img.copy()
-    widths = []
-    for i in range(0, image.shape[0]):
-        for j in range(0, image.shape[1]):
-            if center_img[i, j] == 255:
-                w0 = 0
-                w45 = 0
-                w90 = 0
-                w135 = 0
-                w180 = 1
-                w225 = 1
-                w270 = 1
-                w315 = 1
-                while True:
-                    if image[i, j + w0 + 1] != 0:
-                        w0 += 1
-                    if image[i, j - w180 - 1] != 0:
-                        w180 += 1
-                    if image[i - w90 - 1, j] != 0:
-                        w90 += 1
-                    if image[i + w270 + 1, j] != 0:
-                        w270 += 1
-                    if image[i - w45 - 1, j + w45 + 1] != 0:
-                        w45 += 1
-                    if image[i + w225 + 1, j - w225 - 1] != 0:
-                        w225 += 1
-                    if image[i - w135 - 1, j - w135 - 1] != 0:
-                        w135 += 1
-                    if image[i + w315 + 1, j + w315 + 1] != 0:
-                        w315 += 1
-
-                    if image[i, j + w0 + 1] == 0 and image[i, j - w180 - 1] == 0:
-                        widths.append([i, j, 0, w0, w180])
-                        break
-                    elif image[i - w90 - 1, j] == 0 and image[i + w270 + 1, j] == 0:
-                        widths.append([i, j, 90, w90, w270])
-                        break
-                    elif image[i - w45 - 1, j + w45 + 1] == 0 and image[i + w225 + 1, j - w225 - 1] == 0:
-                        widths.append([i, j, 45, w45, w225])
-                        break
-                    elif image[i - w135 - 1, j - w135 - 1] == 0 and image[i + w315 + 1, j + w315 + 1] == 0:
-                        widths.append([i, j, 135, w135, w315])
-                        break
-    return widths
+    rows, columns = np.nonzero(center_img == 255)
+    widths = vw.widths(segmented_img, rows, columns, (0, 90, 45, 135))
+    return np.column_stack((rows, columns, widths)).tolist()
 
 
 def _local_binary_pattern(window: list):
@@ -185,16 +193,8 @@ def _feature_vectors():
     return features
 
 
-def _loading_model(original: np.ndarray, threshold: np.ndarray, av: np.ndarray, size: int):
-    # Load model of the neuronal network
-    json_file = open(_base_directory_model + 'modelVA.json', "r")
-    loaded_model_json = json_file.read()
-    json_file.close()
-    loaded_model = model_from_json(loaded_model_json)
-
-    # Load weights
-    loaded_model.load_weights(_base_directory_model + 'modelVA.h5')
-
+def _loading_model(original: np.ndarray, threshold: np.ndarray, av: np.ndarray, size: int,
+                   batch_size: int = _predict_batch_size):
     gray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
     (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(gray)
     lab = cv2.cvtColor(original, cv2.COLOR_BGR2LAB)
@@ -215,83 +215,79 @@ def _loading_model(original: np.ndarray, threshold: np.ndarray, av: np.ndarray,
     features = np.array(data)
     predict_img = np.full((segmented_skeleton_img.shape[0], segmented_skeleton_img.shape[1]), 3, dtype=float)
 
-    for row in range(0, features.shape[0]):
-        prediction = loaded_model.predict(np.divide(features[row:row + 1, 2:size], 255), batch_size=1)
-        predict_img[features[row, 0], features[row, 1]] = prediction
+    if features.shape[0] > 0:
+        predictions = predict(np.divide(features[:, 2:size], 255), batch_size=batch_size)
+        predict_img[features[:, 0], features[:, 1]] = predictions[:, 0]
 
     return features, segmented_skeleton_img, thr_img, predict_img
 
 
+def _labelled_prediction(features: np.ndarray, skeleton_img: np.ndarray, original_img: np.ndarray,
+                         predicted_img: np.ndarray, k: float):
+    """
+    Labels the predictions below k as veins (1) and the rest as arteries (2), with 0 for the pixels
+    without prediction, and paints the feature pixels of both classes over the skeleton and the
+    original image.
+    """
+    manual_copy = retina.Retina(skeleton_img, None)
+    manual_copy.bin_to_bgr()
+    manual_copy = manual_copy.get_uint_image()
+    original_copy = original_img.copy()
+    predict_copy = predicted_img.copy()
+    mask0 = predict_copy == 3
+    mask1 = (predict_copy >= 0) & (predict_copy < k)
+    mask2 = (predict_copy >= k) & (predict_copy <= 1)
+    predict_copy[mask1] = 1
+    predict_copy[mask2] = 2
+    predict_copy[mask0] = 0
+
+    rows = features[:, 0].astype(int)
+    columns = features[:, 1].astype(int)
+    labels = predict_copy[rows, columns]
+    for label, colour in [(2, [0, 0, 255]), (1, [255, 0, 0])]:
+        manual_copy[rows[labels == label], columns[labels == label]] = colour
+        original_copy[rows[labels == label], columns[labels == label]] = colour
+    return manual_copy, predict_copy, original_copy
+
+
+def _threshold_accuracies(predictions: np.ndarray, expected: np.ndarray, thresholds: np.ndarray):
+    """
+    Calculates the accuracy of labelling the given predictions with every one of the thresholds,
+    as _labelled_prediction does. The predictions of each class are sorted once, so the true
+    positives and negatives of all the thresholds are counted with a binary search.
+    :param predictions: the network output of every feature row
+    :param expected: the expected output of every feature row, 0 for veins and 1 for arteries
+    :param thresholds: the candidate thresholds
+    :return: the accuracy percentage of each threshold
+    """
+    in_range = (predictions >= 0) & (predictions <= 1)
+    # values out of [0, 1] keep their label whatever the threshold is
+    fixed_labels = np.where(predictions == 3, 0, predictions)[~in_range].astype(int)
+    fixed_expected = expected[~in_range]
+    correct = np.count_nonzero((fixed_labels == 1) & (fixed_expected == 0)) + \
+        np.count_nonzero((fixed_labels == 2) & (fixed_expected == 1))
+
+    veins = np.sort(predictions[in_range & (expected == 0)])
+    arteries = np.sort(predictions[in_range & (expected == 1)])
+    true_negative = np.searchsorted(veins, thresholds, side='left')
+    true_positive = arteries.size - np.searchsorted(arteries, thresholds, side='left')
+    return (100 * (true_positive + true_negative + correct)) / predictions.shape[0]
+
+
 def _validating_model(features: np.ndarray, skeleton_img: np.ndarray, original_img: np.ndarray, predicted_img: np.ndarray, size: int, av: int):
     max_acc = -1
-    rgb_prediction = []
-    network_prediction = []
-    original = []
     if av == 0:
-        manual_copy = retina.Retina(skeleton_img, None)
-        manual_copy.bin_to_bgr()
-        manual_copy = manual_copy.get_uint_image()
-        original_copy = original_img.copy()
-        predict_copy = predicted_img.copy()
-        mask0 = predict_copy == 3
-        mask1 = (predict_copy >= 0) & (predict_copy < 0.8)
-        mask2 = (predict_copy >= 0.8) & (predict_copy <= 1)
-        predict_copy[mask1] = 1
-        predict_copy[mask2] = 2
-        predict_copy[mask0] = 0
-        for row in range(0, features.shape[0]):
-            if predict_copy[features[row, 0], features[row, 1]] == 2:
-                manual_copy[features[row, 0], features[row, 1]] = [0, 0, 255]
-                original_copy[features[row, 0], features[row, 1]] = [0, 0, 255]
-            elif predict_copy[features[row, 0], features[row, 1]] == 1:
-                manual_copy[features[row, 0], features[row, 1]] = [255, 0, 0]
-                original_copy[features[row, 0], features[row, 1]] = [255, 0, 0]
-
-        rgb_prediction = manual_copy
-        network_prediction = predict_copy
-        original = original_copy
+        k = 0.8
     else:
-        for i in range(0, 1000):
-            manual_copy = retina.Retina(skeleton_img, None)
-            manual_copy.bin_to_bgr()
-            manual_copy = manual_copy.get_uint_image()
-            original_copy = original_img.copy()
-            predict_copy = predicted_img.copy()
-            k = 0.001*i
-            mask0 = predict_copy == 3
-            mask1 = (predict_copy >= 0) & (predict_copy < k)
-            mask2 = (predict_copy >= k) & (predict_copy <= 1)
-            predict_copy[mask1] = 1
-            predict_copy[mask2] = 2
-            predict_copy[mask0] = 0
-            true_positive = 0
-            true_negative = 0
-            false_positive = 0
-            false_negative = 0
-            for row in range(0, features.shape[0]):
-                if predict_copy[features[row, 0], features[row, 1]] == 2:
-                    manual_copy[features[row, 0], features[row, 1]] = [0, 0, 255]
-                    original_copy[features[row, 0], features[row, 1]] = [0, 0, 255]
-                elif predict_copy[features[row, 0], features[row, 1]] == 1:
-                    manual_copy[features[row, 0], features[row, 1]] = [255, 0, 0]
-                    original_copy[features[row, 0], features[row, 1]] = [255, 0, 0]
-
-                if int(predict_copy[features[row, 0], features[row, 1]]) == 1 and features[row, size] == 0:
-                    true_negative += 1
-                elif int(predict_copy[features[row, 0], features[row, 1]]) == 2 and features[row, size] == 1:
-                    true_positive += 1
-                elif int(predict_copy[features[row, 0], features[row, 1]]) == 2 and features[row, size] == 0:
-                    false_positive += 1
-                elif int(predict_copy[features[row, 0], features[row, 1]]) == 1 and features[row, size] == 1:
-                    false_negative += 1
-
-            accy = (100 * (true_positive+true_negative)) / features.shape[0]
-            if max_acc < accy:
-                max_acc = accy
-                rgb_prediction = manual_copy
-                network_prediction = predict_copy
-                original = original_copy
-
+        thresholds = np.arange(0, 1000) * 0.001
+        predictions = predicted_img[features[:, 0].astype(int), features[:, 1].astype(int)]
+        accuracies = _threshold_accuracies(predictions, features[:, size], thresholds)
+        best = int(np.argmax(accuracies))
+        max_acc = accuracies[best]
+        k = thresholds[best]
+
+    rgb_prediction, network_prediction, original = _labelled_prediction(
+        features, skeleton_img, original_img, predicted_img, k)
     return max_acc, rgb_prediction, network_prediction, original
 
 
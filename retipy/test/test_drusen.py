@@ -16,14 +16,61 @@
 
 """tests for tortuosity module"""
 
-from unittest import TestCase
+from unittest import TestCase, mock
 from retipy.retina import Retina
 import copy
+import numpy as np
 from numpy.testing import assert_array_equal
 from retipy import drusen
 import cv2
 
 
+def _removing_dark_pixel_pixelwise(image):
+    b, g, r = cv2.split(image)
+    average = np.average(r)
+    for i in range(0, image.shape[0]):
+        for j in range(0, image.shape[1]):
+            if r[i][j] <= average:
+                image[i][j] = 0
+    return image
+
+
+def _threshold_pixelwise(img, t):
+    new_matriz = np.zeros(img.shape)
+    for i in range(0, img.shape[0]):
+        for j in range(0, img.shape[1]):
+            if img[i][j] >= t:
+                new_matriz[i][j] = 1
+    return new_matriz
+
+
+def _threshold_color_pixelwise(otsu_img, img):
+    b, g, r = cv2.split(img)
+    average = np.average(g)
+    for i in range(0, otsu_img.shape[0]):
+        for j in range(0, otsu_img.shape[1]):
+            if otsu_img[i][j] != 0 and g[i][j] < average:
+                otsu_img[i][j] = 0
+    return otsu_img
+
+
+def _bounding_box_pixelwise(gradient):
+    x_min = y_min = x_max = y_max = 0
+    for i in range(0, gradient.shape[0]):
+        for j in range(0, gradient.shape[1]):
+            if gradient[i][j] == 1 and y_max == 0:
+                y_min = i
+                x_min = j
+                x_max = j
+            if gradient[i][j] == 1:
+                y_max = i
+                if x_min > j:
+                    x_min = j
+                elif x_max < j:
+                    x_max = j
+    return [x_min, y_min, x_max, y_max]
+
+
 class TestDrusen(TestCase):
     _resources = 'resources/images/'
     _image_file_name = 'drusen.jpg'
@@ -47,6 +94,37 @@ class TestDrusen(TestCase):
         self.optical_disc = result
         self.assertEqual(result, [142,219])
 
+    def test_detection_optical_disc_stride(self):
+        little_image = drusen.change_resolution(self.image)
+        result = drusen.detect_optical_disc(little_image, 4)
+        self.assertEqual(result, [142,219])
+
+    def test_template_optic_disc_cached(self):
+        self.assertIs(drusen.template_optic_disc(), drusen.template_optic_disc())
+
+    def test_correlation_map(self):
+        image = cv2.medianBlur(drusen.change_resolution(self.image), 5)
+        templates = drusen.template_optic_disc()
+        result = drusen.correlation_map(image, templates, range(200, 210))
+        for i, j in [[200, 0], [200, 39], [205, 350], [209, 680], [209, 699]]:
+            expected = 0
+            if image[i][j][0] != 0:
+                expected = drusen.hist_correlation(templates, drusen.hist_window(image, i, j))
+            self.assertAlmostEqual(result[i, j], expected, places=6)
+        self.assertEqual(result[210:].sum(), 0)
+
+    def test_correlation_map_borders(self):
+        # non black pixels up to the borders, where the windows of hist_window are clipped or empty
+        image = cv2.medianBlur(drusen.change_resolution(self.image), 5)[150:250, 300:390]
+        image = np.maximum(image, 1)
+        templates = drusen.template_optic_disc()
+        for rows, stride in [(range(0, 100), 1), (range(0, 100), 3), (range(30, 70), 1), (range(95, 100), 1)]:
+            result = drusen.correlation_map(image, templates, rows, stride)
+            for i in list(rows)[::stride]:
+                for j in range(0, 90, stride):
+                    expected = drusen.hist_correlation(templates, drusen.hist_window(image, i, j))
+                    self.assertAlmostEqual(result[i, j], expected, places=6)
+
     """
     def test_detection_roi(self):
 
@@ -65,11 +143,58 @@ class TestDrusen(TestCase):
         b2, g2, r2 = cv2.split(self.roi)
         assert_array_equal(g1,g2)
     """
+    def test_apply_mask(self):
+        image = self.image[0:50, 0:60].copy()
+        mask = np.zeros((50, 60))
+        mask[10:20, 5:50] = 1
+        expected = np.zeros(image.shape, dtype=image.dtype)
+        expected[10:20, 5:50] = image[10:20, 5:50]
+        assert_array_equal(drusen.apply_mask(image, mask), expected)
+
+    def test_bounding_box(self):
+        gradient = np.zeros((10, 10))
+        self.assertEqual(drusen._bounding_box(gradient), _bounding_box_pixelwise(gradient))
+        gradient[0, [2, 6]] = 1
+        self.assertEqual(drusen._bounding_box(gradient), _bounding_box_pixelwise(gradient))
+        gradient[3:5, 1] = 1
+        gradient[7, 8] = 1
+        self.assertEqual(drusen._bounding_box(gradient), _bounding_box_pixelwise(gradient))
+
+    def test_main_matches_pixelwise(self):
+        results = []
+        for stages in [{"detect_drusen": drusen.detect_drusen}, {
+                "removing_dark_pixel": _removing_dark_pixel_pixelwise,
+                "threshold": _threshold_pixelwise,
+                "threshold_color": _threshold_color_pixelwise,
+                "_bounding_box": _bounding_box_pixelwise}]:
+            with mock.patch.multiple(drusen, **stages):
+                results.append(drusen.main(self.image.copy()))
+
+        assert_array_equal(results[0].image, results[1].image, "drusen contours do not match")
+        self.assertEqual(results[0].counts, results[1].counts, "drusen classification does not match")
+
+    def test_main_result(self):
+        first = drusen.main(self.image.copy())
+        second = drusen.main(self.image.copy())
+        self.assertEqual(first.counts, second.counts, "counts should not accumulate between calls")
+        self.assertEqual(len(first.drusen), sum(first.counts.values()), "drusen count does not match")
+        for scale, name in enumerate(["Normal", "Medium", "Large"], 1):
+            self.assertEqual(
+                first.counts[name], len([d for d in first.drusen if d.scale == scale]), name)
+        with self.assertRaises(TypeError):
+            first.counts["Normal"] = 0
+        self.assertFalse(first.drusen[0].contour.flags.writeable, "contours should be read only")
+
+    def test_size_drusen(self):
+        self.assertEqual(drusen.size_drusen((10, 18)), 1)
+        self.assertEqual(drusen.size_drusen((30, 18)), 2)
+        self.assertEqual(drusen.size_drusen((10, 40)), 3)
+
     def test_total_drusen(self):
-        drusen.main(self.image)
-        self.assertEqual(drusen.classification_scale["Normal"], 487)
-        self.assertEqual(drusen.classification_scale["Medium"], 128)
-        self.assertEqual(drusen.classification_scale["Large"], 35)
+        result = drusen.main(self.image)
+        self.assertEqual(result.counts["Normal"], 487)
+        self.assertEqual(result.counts["Medium"], 128)
+        self.assertEqual(result.counts["Large"], 35)
         
 
 if __name__ == "__main__":
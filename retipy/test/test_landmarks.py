@@ -41,6 +41,18 @@ class TestLandmarks(TestCase):
 
         assert_array_equal(result, landmarks, "landmark points does not match")
 
+    def test_potential_landmarks_cross(self):
+        skeleton = np.zeros((9, 9), np.uint8)
+        skeleton[4, 1:8] = 255
+        skeleton[1:8, 4] = 255
+        landmarks, segments = l.potential_landmarks(skeleton, 3)
+        expected = skeleton.copy()
+        expected[3:6, 4] = 0
+        expected[4, 3:6] = 0
+
+        assert_array_equal([[3, 4], [4, 3], [4, 4], [4, 5], [5, 4]], landmarks, "landmark points does not match")
+        assert_array_equal(expected, segments, "segmented skeleton does not match")
+
     def test_vessel_width(self):
         self.image.reshape_for_landmarks(2)
         self.image.threshold_image()
@@ -68,6 +80,22 @@ class TestLandmarks(TestCase):
 
         assert_array_equal(result, vessels[0], "Landmark vessels does not match")
 
+    def test_finding_landmark_vessels_patches(self):
+        self.image.reshape_for_landmarks(2)
+        self.image.threshold_image()
+        threshold = self.image.get_uint_image()
+        self.image.skeletonization()
+        skeleton = self.image.get_uint_image()
+        self.image.bin_to_bgr()
+        skeleton_rgb = self.image.get_uint_image()
+        landmarks, segments = l.potential_landmarks(skeleton, 3)
+        widths = l.vessel_width(threshold, landmarks)
+        expected = [l._landmark_vessel_pixelwise(widths[i], landmarks[i], skeleton, skeleton_rgb)
+                    for i in range(0, len(landmarks))]
+
+        self.assertEqual(expected, l.finding_landmark_vessels(widths, landmarks, skeleton, skeleton_rgb))
+        self.assertEqual(expected, l.finding_landmark_vessels(widths, landmarks, skeleton, skeleton_rgb, workers=2))
+
     def test_vessel_number(self):
         self.image.reshape_for_landmarks(2)
         self.image.threshold_image()
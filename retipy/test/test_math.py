@@ -17,6 +17,7 @@
 """tests for tortuosity module"""
 
 from unittest import TestCase
+from numpy.testing import assert_array_equal
 from retipy import math
 
 
@@ -44,3 +45,17 @@ class TestMath(TestCase):
 
     def test_derivative2_centered_h1_error(self):
         self.assertRaises(ValueError, math.derivative2_centered_h1, 0, [])
+
+    def test_derivatives1_centered_h1(self):
+        y = [1, 4, 2, 8, 5]
+        assert_array_equal(
+            math.derivatives1_centered_h1(y),
+            [math.derivative1_centered_h1(i, y) for i in range(1, 4)],
+            "first derivatives do not match")
+
+    def test_derivatives2_centered_h1(self):
+        y = [1, 4, 2, 8, 5]
+        assert_array_equal(
+            math.derivatives2_centered_h1(y),
+            [math.derivative2_centered_h1(i, y) for i in range(1, 4)],
+            "second derivatives do not match")
@@ -25,6 +25,7 @@ from scipy import ndimage
 from skimage import color, filters, io
 from skimage.morphology import skeletonize
 
+from lib import thinning
 from retipy import retina
 
 _resources = 'resources/images/'
@@ -53,6 +54,16 @@ class TestRetina(TestCase):
 
         assert_array_equal(image.np_image, none_constructor_image.np_image, "created images should be the same")
 
+    def test_original_base64(self):
+        """Test the base64 image is only encoded when requested"""
+        self.assertIsNone(self.image._original_base64, "image should not be encoded on construction")
+        self.assertEqual(
+            retina.Retina.get_base64_image(color.rgb2gray(io.imread(_image_path))), self.image.original_base64)
+
+    def test_constructor_2d_image(self):
+        image = np.arange(64, dtype=np.uint8).reshape(8, 8)
+        assert_array_equal(retina.Retina(image, _image_file_name).np_image, color.rgb2gray(image))
+
     def test_segmented(self):
         """Test default value for segmented property"""
         self.assertEqual(
@@ -75,6 +86,14 @@ class TestRetina(TestCase):
         output = [0, 1, 1, 1, 1, 0]
         assert_array_equal(retina_image.np_image[10:16, 11], output, "expected a line")
 
+    def test_apply_thinning_matches_pixelwise(self):
+        self.image.threshold_image()
+        window = self.image.np_image[200:300, 200:300]
+        assert_array_equal(
+            thinning.thinning_zhang_suen(window),
+            thinning._thinning_zhang_suen_pixelwise(window),
+            "lookup table thinning does not match")
+
     def test_save_image(self):
         self.image.save_image(".")
         self.assertTrue(os.path.isfile("./out_" + _image_file_name))
@@ -180,6 +199,16 @@ class TestWindow(TestCase):
         windows = retina.Window(self._retina_image, 8)
         self.assertEqual(windows.windows.shape[0], self._image_size/2, "expected 32 windows")
 
+    def test_create_windows_positions(self):
+        self._retina_image.np_image[20:28, 40:44] = 1
+        windows, positions = retina.Window.create_windows(self._retina_image, 8, "combined", 1)
+        self.assertEqual(windows.dtype, np.uint8, "windows should keep the image type")
+        assert_array_equal(
+            positions[:, 0], [[16, 36], [16, 40], [20, 36], [20, 40], [24, 36], [24, 40]])
+        for window, position in zip(windows, positions):
+            assert_array_equal(
+                window[0], self._retina_image.np_image[position[0, 0]:position[1, 0], position[0, 1]:position[1, 1]])
+
     def test_create_windows_error_dimension(self):
         self.assertRaises(ValueError, retina.Window, self._retina_image, 7)
 
@@ -208,6 +237,23 @@ class TestWindow(TestCase):
         self.assertEqual(len(vessels), 1, "only one vessel should've been extracted")
         self.assertEqual(len(vessels[0][0]), 3, "vessel should have 3 pixels")
 
+    def test_detect_vessels(self):
+        self._retina_image.np_image[10, 10:20] = 1
+        self._retina_image.np_image[11, 20] = 1
+        self._retina_image.np_image[9, 20] = 1
+        self._retina_image.np_image[11, 21] = 1
+        self._retina_image.np_image[9, 21] = 1
+        self._retina_image.np_image[30:40, 30] = 1
+        self._retina_image.np_image[0, 50:60] = 1
+        original = self._retina_image.np_image.copy()
+        vessels = retina.detect_vessels(self._retina_image)
+
+        self.assertEqual(len(vessels), 2, "vessels on the ignored border should not be extracted")
+        assert_array_equal(vessels[0][0], [9, 10, 11])
+        assert_array_equal(vessels[0][1], [20, 19, 20])
+        assert_array_equal(vessels[1][0], np.arange(30, 40))
+        assert_array_equal(self._retina_image.np_image, original, "image should not be modified")
+
     def test_save_window(self):
         self._retina_image.np_image[:, :] = 1
         window = retina.Window(self._retina_image, 8, min_pixels=0)
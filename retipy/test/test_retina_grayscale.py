@@ -126,10 +126,20 @@ class TestRetinaGrayscale(TestCase):
 
     def test_shadow_correction(self):
         self.image.shadow_correction()
+        self.assertEqual(self.image.np_image.dtype, np.uint8, "shadow correction should be an uint8 image")
+
+    def test_rescale(self):
+        image = np.array([[-3, 0, 4], [10, 7, 2]])
+        expected = [[int((value + 3) * (255 / 13)) for value in row] for row in image]
+        assert_array_equal(retina_grayscale.Retina_grayscale._rescale(image), expected)
+        assert_array_equal(retina_grayscale.Retina_grayscale._rescale(image.astype(np.float64)), expected)
 
     def test_homogenize(self):
         self.image.shadow_correction()
+        corrected = self.image.np_image.astype(np.float64)
         self.image.homogenize()
+        expected = np.clip(corrected + 180 - corrected.max(), 0, 255)
+        assert_array_equal(self.image.IH, expected)
 
     def test_tiny_vessels_segmentation(self):
         tiny_segmentation = self.image.tiny_vessels_segmentation()
@@ -147,6 +157,21 @@ class TestRetinaGrayscale(TestCase):
                                                                1).double_segmentation()
         assert_array_equal(double_segmentation, other_segmentation)
 
+    def test_double_vessels_segmentation_sequential(self):
+        normal_segmentation = self.image.normal_vessels_segmentation()
+        self.image.np_image = self.image.original_image
+        tiny_segmentation = self.image.tiny_vessels_segmentation()
+        final_segmentation = np.zeros(self.image.shape, np.uint8)
+        final_segmentation[(normal_segmentation != 0) | (tiny_segmentation != 0)] = 255
+        expected = self.image.get_base64_image(self.image.post_processing(final_segmentation))
+
+        other_segmentation = retina_grayscale.Retina_grayscale(None, _image_path, 1)
+        self.assertEqual(other_segmentation.double_segmentation(), expected)
+        assert_array_equal(other_segmentation.IH, self.image.IH)
+        self.assertIn("normal_shadow_correction", other_segmentation.timings)
+        self.assertIn("tiny_shadow_correction", other_segmentation.timings)
+        self.assertIn("total", other_segmentation.timings)
+
     def test_calculate_roc(self):
         double_segmentation = self.image.normal_vessels_segmentation()
         original_image = retina_grayscale.Retina_grayscale(None, _manual_result_path, 1)
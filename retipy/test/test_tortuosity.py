@@ -17,8 +17,10 @@
 """tests for tortuosity module"""
 
 from unittest import TestCase
-from retipy.retina import Retina
-from retipy import tortuosity as t
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+from retipy.retina import Retina, Window
+from retipy import landmarks, tortuosity as t, tortuosity_measures as tm
 
 
 class TestTortuosity(TestCase):
@@ -38,3 +40,83 @@ class TestTortuosity(TestCase):
         result = t.fractal(self.image.np_image)
         self.assertEqual(result["uri"], "fractal_dimension", "uri does not match")
         self.assertEqual(len(result["data"]), 16, "data size does not match")
+
+    def test_density_workers(self):
+        expected = t.density(self.image.np_image)
+        for executor in ["thread", "process"]:
+            self.assertEqual(
+                t.density(self.image.np_image, workers=3, executor=executor),
+                expected,
+                "{} density does not match".format(executor))
+
+    def test_fractal_workers(self):
+        self.assertEqual(
+            t.fractal(self.image.np_image, workers=2),
+            t.fractal(self.image.np_image),
+            "fractal does not match")
+
+    def test_unknown_executor(self):
+        self.assertRaises(ValueError, t.density, self.image.np_image, workers=2, executor="gpu")
+
+    def test_density_image_extraction(self):
+        result = t.density(self.image.np_image, extraction="image")
+        self.assertEqual(result["uri"], "tortuosity_density", "uri does not match")
+        self.assertEqual(
+            result["data"],
+            [{"notes": "0.97", "x": [168, 168, 224, 224], "y": [56, 112, 112, 56]},
+             {"notes": "0.97", "x": [336, 336, 392, 392], "y": [56, 112, 112, 56]}],
+            "data does not match")
+
+    def test_fractal_image_extraction(self):
+        result = t.fractal(self.image.np_image, extraction="image")
+        self.assertEqual(result["uri"], "fractal_dimension", "uri does not match")
+        self.assertEqual(len(result["data"]), 19, "data size does not match")
+
+    def test_trace_segments(self):
+        # a crossing, split at its pixels with 3 or more neighbours, and a closed loop
+        pixels = np.zeros([16, 11], dtype=np.uint8)
+        pixels[1:10, 5] = pixels[5, 1:10] = 1
+        pixels[11, 3:6] = pixels[14, 3:6] = pixels[12:14, 2] = pixels[12:14, 6] = 1
+        _, segments = landmarks.potential_landmarks(np.pad(pixels, 1), 3)
+        segments = t._trace_segments(segments[1:-1, 1:-1] > 0)
+        self.assertEqual(len(segments), 5, "segment count does not match")
+        assert_array_equal(segments[0], [[1, 2, 3], [5, 5, 5]], "first segment does not match")
+        assert_array_equal(segments[1], [[5, 5, 5], [1, 2, 3]], "second segment does not match")
+        assert_array_equal(segments[2], [[5, 5, 5], [7, 8, 9]], "third segment does not match")
+        assert_array_equal(segments[3], [[7, 8, 9], [5, 5, 5]], "fourth segment does not match")
+        assert_array_equal(
+            segments[4], [[11, 11, 11, 12, 13, 14, 14, 14, 13, 12], [3, 4, 5, 6, 6, 5, 4, 3, 2, 2]],
+            "loop does not match")
+
+    def test_image_vessels(self):
+        skeleton = np.zeros([40, 40], dtype=np.uint8)
+        # a vessel that crosses from the first window to the second one
+        skeleton[8, 4:12] = skeleton[9, 12:20] = skeleton[8, 20:28] = skeleton[7, 28:36] = 255
+        # a vessel with a branch that crosses from the third window to the fourth one
+        skeleton[21:40, 10] = skeleton[27, 11:31] = 255
+        image = Retina(skeleton, "skeleton")
+        windows = Window(image, 20, min_pixels=10)
+        vessels, vessel_windows = t._image_vessels(image, windows, 10)
+        self.assertEqual(vessel_windows, [0, 2, 3], "vessel windows do not match")
+        self.assertEqual(len(vessels), 3, "vessel count does not match")
+        assert_array_equal(
+            vessels[0],
+            [[7] * 8 + [8] * 8 + [9] * 8 + [8] * 8, list(range(35, 3, -1))],
+            "crossing vessel does not match")
+        # the branch and its neighbours are removed, the piece above it is too short
+        assert_array_equal(vessels[1], [list(range(29, 40)), [10] * 11], "vertical vessel does not match")
+        assert_array_equal(vessels[2], [[27] * 19, list(range(12, 31))], "branch does not match")
+
+        measures = tm.evaluate_vessels(*tm.vessel_coordinates(vessels))
+        assert_allclose(
+            measures["linear_regression"], [12.986285714285714, 1, 1], rtol=1e-12,
+            err_msg="linear regression does not match")
+        assert_allclose(
+            measures["distance_measure"], [1.0395444580830915, 1, 1], rtol=1e-12,
+            err_msg="distance measure does not match")
+        assert_allclose(
+            measures["fractal"], [0.8000000000000006, 0.5754887502163474, 0.6228818690495883], rtol=1e-12,
+            err_msg="fractal dimension does not match")
+
+    def test_unknown_extraction(self):
+        self.assertRaises(ValueError, t.fractal, self.image.np_image, extraction="vessel")
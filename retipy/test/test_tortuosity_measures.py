@@ -16,12 +16,65 @@
 
 """tests for tortuosity measures module"""
 
+import math
 from unittest import TestCase
-from numpy.testing import assert_array_equal
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
 
+from lib import fractal_dimension
 from retipy import tortuosity_measures as tm, retina
 
 
+def _loop_curve_length(x, y):
+    # the measures as they were calculated point by point, with python numbers
+    distance = 0
+    for i in range(0, len(x) - 1):
+        distance += ((x[i + 1] - x[i]) ** 2 + (y[i + 1] - y[i]) ** 2) ** 0.5
+    return distance
+
+
+def _loop_linear_regression(x, y, sampling_size=6, retry=True):
+    try:
+        slope = (y[-1] - y[0])/(x[-1] - x[0])
+        y_intercept = y[0] - slope*x[0]
+        sample_distance = max(round(len(x) / sampling_size), 1)
+        samples = range(1, len(x) - 1, sample_distance)
+        y_average = 0
+        for i in samples:
+            y_average += y[i]
+        y_average /= len(samples)
+        top_sum = 0
+        bottom_sum = 0
+        for i in samples:
+            top_sum += (x[i] * slope + y_intercept - y_average) ** 2
+            bottom_sum += (y[i] - y_average) ** 2
+        r_2 = top_sum / bottom_sum
+    except ZeroDivisionError:
+        r_2 = _loop_linear_regression(y, x, retry=False) if retry else 1
+    return 0 if math.isnan(r_2) else r_2
+
+
+def _loop_squared_curvature(x, y):
+    curvatures = []
+    for i in range(1, len(x) - 1):
+        x_1 = (x[i + 1] - x[i - 1])/2
+        x_2 = (x[i + 1] - 2*x[i] + x[i - 1])/4
+        y_1 = (y[i + 1] - y[i - 1])/2
+        y_2 = (y[i + 1] - 2*y[i] + y[i - 1])/4
+        curvatures.append((x_1*y_2 - x_2*y_1)/(y_1**2 + x_1**2)**1.5)
+    return abs(np.trapz(curvatures, range(1, len(x) - 1)))
+
+
+def _random_curves(count, integers):
+    random = np.random.RandomState(7)
+    for _ in range(count):
+        size = random.randint(5, 40)
+        if integers:
+            yield np.cumsum(random.randint(-2, 3, size)).tolist(), np.cumsum(random.randint(-2, 3, size)).tolist()
+        else:
+            yield (random.rand(size) * 50).tolist(), (random.rand(size) * 50).tolist()
+
+
 class TestTortuosityMeasures(TestCase):
     _straight_line =[1, 2, 3, 4, 5, 6, 7]
 
@@ -56,6 +109,10 @@ class TestTortuosityMeasures(TestCase):
         self.assertEqual(
             tm._curve_length([0, 0], [0, 1]), 1, "curve distance does not match")
 
+    def test_curve_length_array(self):
+        self.assertEqual(
+            tm._curve_length(np.array([0, 3, 3]), np.array([0, 4, 5])), 6, "curve distance does not match")
+
     def test_distance_measure_tortuosity(self):
         self.assertEqual(
             tm.distance_measure_tortuosity([0, 2, 4], [0, 2, 4]),
@@ -72,6 +129,12 @@ class TestTortuosityMeasures(TestCase):
             tm._detect_inflection_points([0, 1, 2, 3, 4, 5], [4, 6, 8, 6, 9, 0]),
             "inflection points does not match")
 
+    def test_detect_inflection_points_array(self):
+        assert_array_equal(
+            [2, 3, 4],
+            tm._detect_inflection_points(np.arange(6), np.array([4, 6, 8, 6, 9, 0])),
+            "inflection points does not match")
+
     def test_distance_inflection_count_tortuosity(self):
         self.assertEqual(
             tm.distance_inflection_count_tortuosity([0, 2, 4], [0, 2, 4]),
@@ -95,15 +158,138 @@ class TestTortuosityMeasures(TestCase):
                 [1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 2, 3, 2, 1, 2, 3, 4, 5]) > 0,
             "Tortuosity Density should be greater than zero")
 
+    def test_tortuosity_measures_array(self):
+        x = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+        y = [1, 2, 3, 2, 1, 2, 4, 4, 5]
+        for measure in [
+                tm.linear_regression_tortuosity,
+                tm.tortuosity_density,
+                tm.squared_curvature_tortuosity]:
+            self.assertEqual(
+                measure(x, y),
+                measure(np.array(x), np.array(y)),
+                "{} does not match between lists and arrays".format(measure.__name__))
+
+    def test_linear_regression_tortuosity_vertical_array(self):
+        self.assertEqual(
+            tm.linear_regression_tortuosity(np.array([1, 1, 1, 1]), np.array([1, 2, 3, 4]), retry=False),
+            1,
+            "should return 1")
+
     def test_squared_curvature_tortuosity(self):
         self.assertEqual(
             tm.squared_curvature_tortuosity([1, 2, 3, 4, 5], [1, 2, 3, 4, 5]),
             0,
             "squared curvature tortuosity does not match")
 
+    def test_measures_match_loops(self):
+        self.assertAlmostEqual(tm.linear_regression_tortuosity([1, 2, 4, 6, 6], [2, 1, 1, 3, 1]), 0.2)
+        for integers in [True, False]:
+            for x, y in _random_curves(1000, integers):
+                assert_allclose(
+                    tm._curve_length(x, y), _loop_curve_length(x, y), rtol=1e-12,
+                    err_msg="curve length does not match")
+                assert_allclose(
+                    tm.linear_regression_tortuosity(x, y), _loop_linear_regression(x, y), rtol=1e-12,
+                    err_msg="linear regression tortuosity does not match")
+                try:
+                    expected = _loop_squared_curvature(x, y)
+                except ZeroDivisionError:
+                    self.assertRaises(ZeroDivisionError, tm.squared_curvature_tortuosity, x, y)
+                    continue
+                assert_allclose(
+                    tm.squared_curvature_tortuosity(x, y), expected, rtol=1e-12,
+                    err_msg="squared curvature does not match")
+
     def test_smooth_tortuosity(self):
         self.assertEqual(tm.smooth_tortuosity_cubic(range(0, 11, 1), [0, 1, 2, 3, 4, 5, 4, 3, 2, 1, 0]), 0)
         
     def test_fractal_tortuosity_curve(self):
         val = tm.fractal_tortuosity_curve([1, 2, 3, 4, 5], [10, 11, 12, 13, 14])
         self.assertEqual(int(val), 1, "tortuosity of a line should be close to 1")
+
+    def test_vessel_coordinates(self):
+        x, y, offsets = tm.vessel_coordinates([[[1, 2, 3], [4, 5, 6]], [np.array([7, 8]), np.array([9, 9])]])
+        assert_array_equal(x, [1, 2, 3, 7, 8], "x points do not match")
+        assert_array_equal(y, [4, 5, 6, 9, 9], "y points do not match")
+        assert_array_equal(offsets, [0, 3, 5], "offsets do not match")
+
+    def test_evaluate_vessels(self):
+        vessels = [
+            [[1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 2, 3, 2, 1, 2, 4, 4, 5]],
+            [[1, 2, 3, 4, 5, 6, 7], [1, 2, 3, 4, 5, 6, 7]],
+            [[3, 4, 5, 6, 7, 8], [9, 9, 9, 9, 9, 9]]]
+        measures = tm.evaluate_vessels(*tm.vessel_coordinates(vessels), sampling_size=3)
+        self.assertEqual(measures.dtype.names, tm.MEASURES, "measures do not match")
+        for i, (x, y) in enumerate(vessels):
+            self.assertEqual(
+                measures["linear_regression"][i], tm.linear_regression_tortuosity(x, y, 3))
+            self.assertEqual(measures["distance_measure"][i], tm.distance_measure_tortuosity(x, y))
+            self.assertEqual(
+                measures["inflection_count"][i], tm.distance_inflection_count_tortuosity(x, y))
+            self.assertEqual(measures["squared_curvature"][i], tm.squared_curvature_tortuosity(x, y))
+            self.assertEqual(measures["density"][i], tm.tortuosity_density(x, y))
+            self.assertEqual(measures["fractal"][i], tm.fractal_tortuosity_curve(x, y))
+
+    def test_evaluate_vessels_random(self):
+        # short vessels next to a long one, as the vessels of a whole image
+        vessels = list(_random_curves(200, True))
+        random = np.random.RandomState(3)
+        vessels.insert(50, [np.arange(2000).tolist(), np.cumsum(random.randint(-1, 2, 2000)).tolist()])
+        # vertical and horizontal vessels take the fallbacks of the linear regression
+        vessels.insert(20, [[4] * 12, list(range(12))])
+        vessels.insert(80, [list(range(9)), [2] * 9])
+        measures = ("linear_regression", "distance_measure", "inflection_count", "density", "fractal")
+        result = tm.evaluate_vessels(*tm.vessel_coordinates(vessels), measures=measures)
+        for measure in measures:
+            assert_array_equal(
+                tm.evaluate_vessels(*tm.vessel_coordinates(vessels), measures=(measure,))[measure],
+                result[measure],
+                "{} should not depend on the other measures".format(measure))
+        for i, (x, y) in enumerate(vessels):
+            assert_allclose(result["linear_regression"][i], _loop_linear_regression(x, y), rtol=1e-12)
+            self.assertEqual(result["distance_measure"][i], tm.distance_measure_tortuosity(x, y))
+            self.assertEqual(result["inflection_count"][i], tm.distance_inflection_count_tortuosity(x, y))
+            self.assertEqual(result["density"][i], tm.tortuosity_density(x, y))
+            assert_allclose(result["fractal"][i], tm.fractal_tortuosity_curve(x, y), rtol=1e-12)
+        curvatures = tm.evaluate_vessels(*tm.vessel_coordinates(vessels), measures=("squared_curvature",))
+        for i, (x, y) in enumerate(vessels):
+            try:
+                expected = _loop_squared_curvature(x, y)
+            except ZeroDivisionError:
+                expected = np.nan
+            assert_allclose(
+                curvatures["squared_curvature"][i], expected, rtol=1e-12, err_msg="squared curvature does not match")
+
+    def test_evaluate_vessels_measures(self):
+        measures = tm.evaluate_vessels(*tm.vessel_coordinates([]), measures=("density",))
+        self.assertEqual(measures.dtype.names, ("density",), "measures do not match")
+        self.assertEqual(measures.size, 0, "there should not be any vessel")
+        self.assertRaises(ValueError, tm.evaluate_vessels, [1, 2], [1, 2], [0, 2], ("unknown",))
+
+    def test_fractal_tortuosity_curve_image(self):
+        x = [3, 4, 5, 6, 7, 8, 9, 10, 11]
+        y = [7, 8, 8, 9, 12, 11, 10, 8, 8]
+        image = np.zeros([16, 16], dtype=bool)
+        image[np.array(x) - 3, np.array(y) - 7] = True
+        self.assertEqual(
+            tm.fractal_tortuosity_curve(x, y),
+            fractal_dimension.fractal_dimension(image),
+            "fractal tortuosity should match the one of the curve image")
+        self.assertEqual(x, [3, 4, 5, 6, 7, 8, 9, 10, 11], "the curve should not be modified")
+        self.assertEqual(y, [7, 8, 8, 9, 12, 11, 10, 8, 8], "the curve should not be modified")
+
+    def test_fractal_dimension_batch(self):
+        line = np.zeros([24, 40], dtype=bool)
+        line[np.arange(24), np.arange(24) + 10] = True
+        band = np.zeros([24, 40], dtype=bool)
+        band[5:20, :] = True
+        # boxes of 16, 8 and 4 pixels, the partial ones on the borders are counted too
+        self.assertAlmostEqual(
+            fractal_dimension.fractal_dimension(line),
+            -np.polyfit(np.log([16, 8, 4]), np.log([4, 6, 12]), 1)[0],
+            msg="fractal dimension does not match")
+        assert_array_equal(
+            fractal_dimension.fractal_dimension(np.stack([line, band])),
+            [fractal_dimension.fractal_dimension(line), fractal_dimension.fractal_dimension(band)],
+            "batch fractal dimension does not match")
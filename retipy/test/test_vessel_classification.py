@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """tests for vessel classification module"""
+import threading
 from unittest import TestCase
 from retipy.retina import Retina
 from retipy import landmarks as l
@@ -111,11 +112,40 @@ class TestVesselClassification(TestCase):
         assert_array_equal(result, segments[:, 20], "Segmented skeleton image does not match")
         assert_array_equal(result2, predictions[:, 20], "Neural Network predictions does not match")
 
+    def test_load_model_cached(self):
+        self.assertIs(vc.load_model(), vc.load_model(), "the model should be loaded only once")
+
+    def test_predict_threads(self):
+        data = np.random.RandomState(0).rand(50, vc.load_model().input_shape[1])
+        expected = vc.predict(data)
+        results = [None] * 4
+
+        def run(index):
+            results[index] = vc.predict(data)
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for result in results:
+            assert_array_equal(result, expected, "predictions should not depend on the thread")
+
+    def test_loading_model_batch_size(self):
+        features, segments, thr, predictions = vc._loading_model(self.original, self.manual.np_image, self.av, 38)
+        features, segments, thr, predictions_small = vc._loading_model(
+            self.original, self.manual.np_image, self.av, 38, batch_size=7)
+        assert_array_equal(predictions, predictions_small, "predictions should not depend on the batch size")
+
     def test_validating_model(self):
         features, segments, thr, predictions = vc._loading_model(self.original, self.manual.np_image, self.av, 38)
         acc, rgb, network, original = vc._validating_model(features, segments, self.original, predictions, 38, 1)
         self.assertEqual(76.18243243243244, acc,  "Wrong validation, should return 81.1214953271028")
 
+    def test_threshold_accuracies(self):
+        accuracies = vc._threshold_accuracies(
+            np.array([0.1, 0.5, 0.9, 3]), np.array([0, 1, 1, 0]), np.array([0, 0.5, 1]))
+        assert_array_equal([50, 75, 25], accuracies, "Accuracies does not match")
+
     def test_validating_model_without_av(self):
         features, segments, thr, predictions = vc._loading_model(self.original, self.manual.np_image, self.av, 38)
         acc, rgb, network, original = vc._validating_model(features, segments, self.original, predictions, 38, 0)
@@ -0,0 +1,40 @@
+# Retipy - Retinal Image Processing on Python
+# Copyright (C) 2017  Maria Aguiar
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""tests for vessel width module"""
+from unittest import TestCase
+from retipy import vessel_width as vw
+import numpy as np
+from numpy.testing import assert_array_equal
+
+
+class TestVesselWidth(TestCase):
+
+    def setUp(self):
+        # horizontal vessel five pixels wide
+        self.image = np.zeros((20, 32), np.uint8)
+        self.image[8:13, 2:29] = 255
+
+    def test_widths(self):
+        widths = vw.widths(self.image, [10, 9], [15, 15])
+        assert_array_equal(widths, [[45, 2, 2], [45, 1, 3]], "widths does not match")
+
+    def test_widths_angle_order(self):
+        widths = vw.widths(self.image, [10], [15], (0, 90, 45, 135))
+        assert_array_equal(widths, [[90, 2, 2]], "widths does not match")
+
+    def test_widths_empty(self):
+        self.assertEqual(vw.widths(self.image, [], []).shape, (0, 3), "no widths expected")
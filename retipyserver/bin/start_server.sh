@@ -2,4 +2,5 @@
 
 export FLASK_APP=retipyserver
 export FLASK_DEBUG=true
+export RETIPY_PRELOAD_MODELS=true
 exec flask run
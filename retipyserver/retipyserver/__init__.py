@@ -7,3 +7,4 @@ from . import endpoint_segmentation
 from . import endpoint_landmarks
 from . import endpoint_vessel_classification
 from . import endpoint_drusen
+from . import endpoint_jobs
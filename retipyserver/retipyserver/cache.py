@@ -0,0 +1,223 @@
+# Retipy - Retinal Image Processing on Python
+# Copyright (C) 2018  Maria Aguiar
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cache of the endpoint responses, addressed by the content of the uploaded images.
+
+The key of a response is a hash of the path and the query parameters of the request and of the
+format and the bytes of its images, as they were uploaded, so the same file hits the cache no
+matter how it was uploaded and the images are not decoded to build the key. Responses are kept in
+a least recently used memory tier bounded in bytes and, optionally, in a directory that can be
+shared by several server processes, also bounded in bytes.
+
+The cache used by the endpoints is configured with environment variables:
+ * RETIPY_CACHE_BYTES: size of the memory tier, 256 MiB by default, 0 disables it.
+ * RETIPY_CACHE_DIR: directory of the disk tier, disabled by default.
+ * RETIPY_CACHE_DIR_BYTES: size of the disk tier, 1 GiB by default.
+"""
+
+import collections
+import functools
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import flask
+from PIL import Image
+from . import uploads
+
+
+class ResultCache:
+    """
+    Two tier cache of responses. A response is a tuple with the status code, the headers and the
+    body.
+    """
+
+    def __init__(
+            self, max_bytes: int = 256 * 1024 * 1024, directory: str = None, max_disk_bytes: int = 1024 ** 3):
+        """
+        :param max_bytes: maximum size of the bodies kept in memory
+        :param directory: directory of the disk tier, None to keep the responses only in memory
+        :param max_disk_bytes: maximum size of the files of the disk tier
+        """
+        self._max_bytes = max_bytes
+        self._directory = directory
+        self._max_disk_bytes = max_disk_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key)
+
+    def _remember(self, key: str, response: tuple):
+        size = len(response[2])
+        if size > self._max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= len(self._entries.pop(key)[2])
+        self._entries[key] = response
+        self._bytes += size
+        while self._bytes > self._max_bytes:
+            self._bytes -= len(self._entries.popitem(last=False)[1][2])
+
+    def _read(self, key: str):
+        try:
+            with open(self._path(key), "rb") as file:
+                status_code, headers = json.loads(file.readline().decode("utf-8"))
+                response = status_code, [tuple(header) for header in headers], file.read()
+            # the modification time orders the files from the least recently used one
+            os.utime(self._path(key))
+            return response
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key: str, response: tuple):
+        status_code, headers, body = response
+        if len(body) > self._max_disk_bytes:
+            return
+        # written to a temporary file and renamed, other processes never see a partial response
+        handle, path = tempfile.mkstemp(dir=self._directory, prefix=".")
+        with os.fdopen(handle, "wb") as file:
+            file.write(json.dumps([status_code, headers]).encode("utf-8") + b"\n")
+            file.write(body)
+        os.replace(path, self._path(key))
+        self._evict_files()
+
+    def _evict_files(self):
+        # the directory is read on every write, as other processes add and remove files too
+        files = []
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self._max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already removed by another process
+                pass
+            total -= size
+
+    def get(self, key: str):
+        """
+        :param key: the key of the response
+        :return: the cached response, or None if it is not in any tier
+        """
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+        response = None if self._directory is None else self._read(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+                self._remember(key, response)
+        return response
+
+    def put(self, key: str, response: tuple):
+        """
+        Stores a response in every tier.
+        :param key: the key of the response
+        :param response: a tuple with the status code, the headers and the body
+        """
+        with self._lock:
+            self._remember(key, response)
+        if self._directory is not None:
+            self._write(key, response)
+
+    def statistics(self) -> dict:
+        """
+        :return: the hit and miss counters and the size of the memory tier
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes}
+
+
+def _request_key(names: tuple):
+    request = flask.request
+    images = uploads.uploaded_images(*names)
+    if images is None:
+        return None
+    key = hashlib.sha256()
+    key.update(json.dumps([request.path, sorted(request.args.items(multi=True))]).encode("utf-8"))
+    for file in images:
+        data = file.read()
+        try:
+            # only the header is read, the pixels are decoded once, by the endpoint
+            image_format = Image.open(io.BytesIO(data)).format
+        except (OSError, ValueError):
+            # the endpoint decides what to do with an image that can not be decoded
+            return None
+        key.update(json.dumps([image_format, len(data)]).encode("utf-8"))
+        key.update(data)
+    return key.hexdigest()
+
+
+def cached(*names: str):
+    """
+    Decorator that answers an endpoint from the cache when its images and parameters were already
+    processed, and stores the successful responses of the endpoint otherwise.
+    :param names: the names of the images of the endpoint, as given to uploads.uploaded_images
+    :return: the decorator
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def cached_view(*args, **kwargs):
+            key = _request_key(names)
+            if key is None:
+                return view(*args, **kwargs)
+            response = results.get(key)
+            if response is None:
+                response = flask.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response = (response.status_code, response.headers.to_wsgi_list(), response.get_data())
+                results.put(key, response)
+            status_code, headers, body = response
+            return flask.Response(body, status=status_code, headers=headers)
+        return cached_view
+    return decorator
+
+
+results = ResultCache(
+    max_bytes=int(os.environ.get("RETIPY_CACHE_BYTES", 256 * 1024 * 1024)),
+    directory=os.environ.get("RETIPY_CACHE_DIR"),
+    max_disk_bytes=int(os.environ.get("RETIPY_CACHE_DIR_BYTES", 1024 ** 3)))
@@ -21,29 +21,29 @@ Module with endpoints related to server functionality and status.
 import flask
 from . import app
 from . import base_url
+from . import cache
 from retipy import drusen
-from PIL import Image
 from retipy.retina import Retina
 import numpy as np
-import base64
-import io
-import imutils
 import cv2
+from . import uploads
 
 @app.route(base_url + "drusenclassificationbysize", methods=["POST"])
+@cache.cached("image")
 def post_drusen_classification_by_size():
-	
+	data = {"success": False}
+
 	if flask.request.method == "POST":
-		json = flask.request.get_json(silent=True)
-		if json is not None:  # pragma: no cover
-			image = base64.b64decode(json["image"])
-			image = Image.open(io.BytesIO(image))   
-			image.save("tmp_drusen.jpg")
-			image = cv2.imread("tmp_drusen.jpg")
-			drusen_image, classification_scale  = drusen.main(image)
-			cv2.imwrite("tmp_drusen.jpg",drusen_image)
-			drusen_image = Retina._open_image("tmp_drusen.jpg")
+		images = uploads.uploaded_images("image")
+		if images is not None:  # pragma: no cover
+			# decode and encode in memory, concurrent requests must not share any file
+			image = np.frombuffer(images[0].read(), dtype=np.uint8)
+			image = cv2.imdecode(image, cv2.IMREAD_COLOR)
+			result = drusen.main(image)
+			classification_scale = result.counts
+			drusen_image = cv2.cvtColor(result.image, cv2.COLOR_BGR2RGB)
 			information = "Total Normal Drusen (<= 63 micron) : "+ str(classification_scale["Normal"])+",Total Medium Drusen (>  63 micron and <= 125 micron) : "+str(classification_scale["Medium"])+",Total Large Drusen  (>  125 micron) : "+str(classification_scale["Large"])+",Normal= Green Color Medium Blue Color Large = Red Color"
+			if uploads.png_requested():
+				return uploads.png_response(Retina.get_png_image(drusen_image, False), {"X-Drusen-Information": information})
 			data = {"drusen": Retina.get_base64_image(drusen_image,False), "information": information}
 	return flask.jsonify(data)
-
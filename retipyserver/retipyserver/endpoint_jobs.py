@@ -0,0 +1,97 @@
+# Retipy - Retinal Image Processing on Python
+# Copyright (C) 2018  Maria Aguiar
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Module with the REST endpoints to run any other endpoint as a background job.
+
+A job is submitted with the same request the endpoint takes, posted to base_url + "jobs/" followed
+by the path of the endpoint, e.g. /retipy/jobs/drusenclassificationbysize. The answer has the id
+of the job, which is used to poll its status, fetch its result or cancel it.
+"""
+
+import flask
+from werkzeug import exceptions
+from . import app
+from . import base_url
+from . import jobs
+
+jobs_url = base_url + "jobs/"
+
+
+def _job_response(job_id: str, status: str, code: int = 200):
+    if status is None:
+        return flask.make_response(flask.jsonify({"success": False}), 404)
+    return flask.make_response(flask.jsonify({"id": job_id, "status": status}), code)
+
+
+@app.route(jobs_url + "<path:endpoint>", methods=["POST"])
+def post_job(endpoint: str):
+    """
+    Queues a request to an endpoint.
+    :param endpoint: the path of the endpoint, relative to base_url
+    :return: HTTP status 202 with the id of the job, 404 if the endpoint does not exist or 503 if
+        the queue is full
+    """
+    path = base_url + endpoint
+    try:
+        view, _ = app.url_map.bind("").match(path, method="POST")
+    except exceptions.HTTPException:
+        view = None
+    if view is None or view == post_job.__name__:
+        return flask.make_response(flask.jsonify({"success": False}), 404)
+
+    request = flask.request
+    job_id = jobs.queue.submit(path, request.query_string, request.content_type, request.get_data())
+    if job_id is None:
+        return flask.make_response(flask.jsonify({"success": False}), 503)
+    response = _job_response(job_id, jobs.QUEUED, 202)
+    response.headers["Location"] = jobs_url + job_id
+    return response
+
+
+@app.route(jobs_url + "<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    """
+    :param job_id: the id of the job
+    :return: the id and the status of the job, or HTTP status 404 if it does not exist
+    """
+    return _job_response(job_id, jobs.queue.status(job_id))
+
+
+@app.route(jobs_url + "<job_id>/result", methods=["GET"])
+def get_job_result(job_id: str):
+    """
+    :param job_id: the id of the job
+    :return: the response of the endpoint if the job is done, otherwise its status with HTTP status
+        202 while it is queued or running, 410 if it failed or was cancelled and 404 if it does not
+        exist
+    """
+    result = jobs.queue.result(job_id)
+    if result is not None:
+        status_code, headers, body = result
+        return flask.Response(body, status=status_code, headers=headers)
+    status = jobs.queue.status(job_id)
+    return _job_response(job_id, status, 202 if status in (jobs.QUEUED, jobs.RUNNING) else 410)
+
+
+@app.route(jobs_url + "<job_id>", methods=["DELETE"])
+def delete_job(job_id: str):
+    """
+    Cancels a job.
+    :param job_id: the id of the job
+    :return: the id and the status of the job, or HTTP status 404 if it does not exist
+    """
+    return _job_response(job_id, jobs.queue.cancel(job_id))
@@ -19,27 +19,27 @@ Module with all REST endpoints to identify and classify landmarks given a graysc
 All operations are implemented as POST
 """
 
-import base64
 import flask
-import io
 import numpy as np
 from PIL import Image
 from retipy import landmarks
 from . import app
 from . import base_url
+from . import cache
+from . import uploads
 
 landmarks_url = base_url + "landmarks/"
 
 
 @app.route(landmarks_url + "classification", methods=["POST"])
+@cache.cached("image")
 def post_landmarks_classification():
     data = {"success": False}
 
     if flask.request.method == "POST":
-        json = flask.request.get_json(silent=True)
-        if json is not None:  # pragma: no cover
-            image = base64.b64decode(json["image"])
-            image = Image.open(io.BytesIO(image)).convert('L')
+        images = uploads.uploaded_images("image")
+        if images is not None:  # pragma: no cover
+            image = Image.open(images[0]).convert('L')
             bifurcations_data, crossings_data = landmarks.classification(np.array(image), 20)
             data = {"bifurcations": bifurcations_data, "crossings": crossings_data}
     return flask.jsonify(data)
@@ -21,6 +21,7 @@ Module with endpoints related to server functionality and status.
 import flask
 from . import app
 from . import base_url
+from . import cache
 
 
 @app.route(base_url + "status", methods=["GET"])
@@ -31,3 +32,12 @@ def retipy_server_status():
     :return: HTTP status 200 if the REST server is working.
     """
     return flask.make_response('', 200)
+
+
+@app.route(base_url + "cache", methods=["GET"])
+def retipy_server_cache():
+    """
+    Endpoint with the counters of the result cache of this server process.
+    :return: the hits of the memory and disk tiers, the misses and the size of the memory tier.
+    """
+    return flask.jsonify(cache.results.statistics())
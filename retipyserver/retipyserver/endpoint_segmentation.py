@@ -20,7 +20,6 @@ All operations are implemented as POST
 """
 
 import base64
-import io
 import flask
 import numpy as np
 from PIL import Image
@@ -28,18 +27,24 @@ import cv2
 from retipy import retina_grayscale
 from . import app
 from . import base_url
+from . import cache
+from . import uploads
 
 segmentation_url = base_url + "segmentation/"
 
 @app.route(segmentation_url + "double_segmentation", methods=["POST"])
+@cache.cached("image")
 def post_segmentation_double_segmentation():
     data = {"success": False} # pragma: no cover
 
     if flask.request.method == "POST": # pragma: no cover
-        json = flask.request.get_json(silent=True)
-        if json is not None:  # pragma: no cover
-            image = base64.b64decode(json["image"])
-            image = Image.open(io.BytesIO(image))
+        images = uploads.uploaded_images("image")
+        if images is not None:  # pragma: no cover
+            image = Image.open(images[0])
             retina = retina_grayscale.Retina_grayscale(np.array(image), None)
-            data = {"segmentation": retina.double_segmentation()}
+            segmentation = retina.double_segmentation()
+            app.logger.info("double segmentation timings: %s", retina.timings)
+            if uploads.png_requested():
+                return uploads.png_response(base64.b64decode(segmentation))
+            data = {"segmentation": segmentation}
     return flask.jsonify(data) # pragma: no cover
@@ -19,39 +19,39 @@ Module with all REST endpoints to calculate tortuosity measures given a grayscal
 All operations are implemented as POST
 """
 
-import base64
 import flask
-import io
 import numpy as np
 from PIL import Image
 from retipy import tortuosity
 from . import app
 from . import base_url
+from . import cache
+from . import uploads
 
 tortuosity_url = base_url + "tortuosity/"
 
 
 @app.route(tortuosity_url + "density", methods=["POST"])
+@cache.cached("image")
 def post_tortuosity_density():
     data = {"success": False}
 
     if flask.request.method == "POST":
-        json = flask.request.get_json(silent=True)
-        if json is not None:  # pragma: no cover
-            image = base64.b64decode(json["image"])
-            image = Image.open(io.BytesIO(image)).convert('L')
+        images = uploads.uploaded_images("image")
+        if images is not None:  # pragma: no cover
+            image = Image.open(images[0]).convert('L')
             data = tortuosity.density(np.array(image))
     return flask.jsonify(data)
 
 
 @app.route(tortuosity_url + "fractal", methods=["POST"])
+@cache.cached("image")
 def post_tortuosity_fractal():
     data = {"success": False}
 
     if flask.request.method == "POST":
-        json = flask.request.get_json(silent=True)
-        if json is not None:  # pragma: no cover
-            image = base64.b64decode(json["image"])
-            image = Image.open(io.BytesIO(image)).convert('L')
+        images = uploads.uploaded_images("image")
+        if images is not None:  # pragma: no cover
+            image = Image.open(images[0]).convert('L')
             data = tortuosity.fractal(np.array(image))
     return flask.jsonify(data)
@@ -20,33 +20,36 @@ and a/v image
 All operations are implemented as POST
 """
 
-import base64
 import flask
-import io
+import os
 import numpy as np
 from PIL import Image
 from retipy import vessel_classification
 from retipy.retina import Retina
 from . import app
 from . import base_url
+from . import cache
+from . import uploads
 
 vessel_classification_url = base_url + "vessel_classification/"
 
+# the network is loaded on the first request unless the worker asks to have it ready at startup
+if os.environ.get("RETIPY_PRELOAD_MODELS"):  # pragma: no cover
+    vessel_classification.load_model()
+
 
 @app.route(vessel_classification_url + "classification", methods=["POST"])
+@cache.cached("segmented_image", "original_image")
 def post_vessel_classification():
     data = {"success": False}
 
     if flask.request.method == "POST":
-        json = flask.request.get_json(silent=True)
-        if json is not None:  # pragma: no cover
-            segmented = base64.b64decode(json["segmented_image"])
-            segmented = Image.open(io.BytesIO(segmented)).convert('L')
-            original = base64.b64decode(json["original_image"])
-            original = Image.open(io.BytesIO(original)).convert('RGB')
-            data = {
-                "classification": Retina.get_base64_image(
-                    vessel_classification.classification(
-                        np.array(original), np.array(segmented)),
-                    False)}
+        images = uploads.uploaded_images("segmented_image", "original_image")
+        if images is not None:  # pragma: no cover
+            segmented = Image.open(images[0]).convert('L')
+            original = Image.open(images[1]).convert('RGB')
+            classification = vessel_classification.classification(np.array(original), np.array(segmented))
+            if uploads.png_requested():
+                return uploads.png_response(Retina.get_png_image(classification, False))
+            data = {"classification": Retina.get_base64_image(classification, False)}
     return flask.jsonify(data)
@@ -0,0 +1,222 @@
+# Retipy - Retinal Image Processing on Python
+# Copyright (C) 2018  Maria Aguiar
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Local queue that runs endpoint requests in the background, so long analyses do not hold an HTTP
+worker until they finish.
+
+A job is a copy of a POST request to one of the endpoints. It is dispatched to the flask app by a
+pool of workers and its response is kept until it expires. The jobs live in the memory of the
+server process, so the server must run as a single process (with threads) for every request to
+see the same jobs.
+
+The queue used by the endpoints is configured with environment variables:
+ * RETIPY_JOB_WORKERS: number of jobs that run at the same time, the number of cpus by default.
+ * RETIPY_JOB_EXECUTOR: "process" (default) or "thread".
+ * RETIPY_JOB_TTL: seconds a finished job is kept, 600 by default.
+ * RETIPY_JOB_LIMIT: maximum number of unfinished jobs, 64 by default.
+"""
+
+import functools
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+def _process_pool(max_workers: int):
+    # tensorflow does not survive a fork, workers start clean and load their own models
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+_EXECUTORS = {"thread": ThreadPoolExecutor, "process": _process_pool}
+
+
+def _run(path: str, query_string: bytes, content_type: str, body: bytes):
+    """
+    Dispatches a POST request to the flask app.
+    :param path: the path of the endpoint
+    :param query_string: the query string of the request
+    :param content_type: the content type of the request, with its parameters
+    :param body: the body of the request
+    :return: a tuple with the status code, the headers and the body of the response
+    """
+    from . import app
+    with app.test_request_context(
+            path, method="POST", query_string=query_string, content_type=content_type, data=body):
+        response = app.full_dispatch_request()
+        return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+
+class _Job:
+    def __init__(self, future, pool_broken):
+        self.future = future
+        self.cancelled = False
+        self.broken = False
+        self.finished = None
+        self._pool_broken = pool_broken
+        future.add_done_callback(self._finish)
+
+    def _finish(self, future):
+        self.finished = time.monotonic()
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            # a worker of its pool died (e.g. killed when out of memory), the pool fails every job
+            # it had, running or queued, and does not run any other one
+            self.broken = True
+            self._pool_broken()
+
+    def status(self) -> str:
+        if self.broken:
+            return FAILED
+        if self.cancelled or self.future.cancelled():
+            return CANCELLED
+        if self.future.done():
+            return FAILED if self.future.exception() is not None else DONE
+        return RUNNING if self.future.running() else QUEUED
+
+
+class JobQueue:
+    """
+    Runs endpoint requests in a pool of workers and keeps their responses for a while.
+    """
+
+    def __init__(self, workers: int = None, executor: str = "process", ttl: float = 600, limit: int = 64):
+        """
+        :param workers: number of jobs that run at the same time, the number of cpus by default
+        :param executor: "process" to run the jobs in worker processes or "thread" to run them in
+            threads of the server process
+        :param ttl: seconds a finished job is kept before it expires
+        :param limit: maximum number of jobs that are queued or running
+        """
+        if executor not in _EXECUTORS:
+            raise ValueError("unknown executor '{}', expected one of {}".format(executor, sorted(_EXECUTORS)))
+        self._workers = workers or os.cpu_count() or 1
+        self._executor = executor
+        self._ttl = ttl
+        self._limit = limit
+        self._pool = None
+        self._broken_pool = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        now = time.monotonic()
+        for job_id in [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished is not None and now - job.finished > self._ttl]:
+            del self._jobs[job_id]
+
+    def submit(self, path: str, query_string: bytes, content_type: str, body: bytes) -> str:
+        """
+        Queues a POST request to the endpoint in the given path.
+        :param path: the path of the endpoint
+        :param query_string: the query string of the request
+        :param content_type: the content type of the request, with its parameters
+        :param body: the body of the request
+        :return: the id of the job, or None if the queue is full
+        """
+        with self._lock:
+            self._expire()
+            if sum(job.finished is None for job in self._jobs.values()) >= self._limit:
+                return None
+            if self._pool is None or self._pool is self._broken_pool:
+                self._new_pool()
+            try:
+                future = self._pool.submit(_run, path, query_string, content_type, body)
+            except BrokenProcessPool:
+                # the pool broke and none of its jobs has finished yet
+                self._new_pool()
+                future = self._pool.submit(_run, path, query_string, content_type, body)
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = _Job(future, functools.partial(self._set_broken_pool, self._pool))
+            return job_id
+
+    def _set_broken_pool(self, pool):
+        # called from the done callbacks, which may run while the lock is held
+        self._broken_pool = pool
+
+    def _new_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self._pool = _EXECUTORS[self._executor](max_workers=self._workers)
+
+    def status(self, job_id: str) -> str:
+        """
+        :param job_id: the id of the job
+        :return: one of QUEUED, RUNNING, DONE, FAILED or CANCELLED, or None if the job does not
+            exist or has expired
+        """
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            return None if job is None else job.status()
+
+    def result(self, job_id: str):
+        """
+        :param job_id: the id of the job
+        :return: a tuple with the status code, the headers and the body of the response of a DONE
+            job, or None for any other job
+        """
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is None or job.status() != DONE:
+                return None
+            return job.future.result()
+
+    def cancel(self, job_id: str) -> str:
+        """
+        Cancels a job. A queued job never runs, a running job can not be interrupted but its
+        response is discarded.
+        :param job_id: the id of the job
+        :return: the status of the job after the cancellation, or None if the job does not exist
+        """
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if not job.future.done():
+                job.cancelled = True
+                job.future.cancel()
+            return job.status()
+
+    def shutdown(self):
+        """
+        Cancels the queued jobs and stops the workers once the running jobs finish.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                job.future.cancel()
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+queue = JobQueue(
+    workers=int(os.environ.get("RETIPY_JOB_WORKERS", 0)),
+    executor=os.environ.get("RETIPY_JOB_EXECUTOR", "process"),
+    ttl=float(os.environ.get("RETIPY_JOB_TTL", 600)),
+    limit=int(os.environ.get("RETIPY_JOB_LIMIT", 64)))
@@ -0,0 +1,77 @@
+# Retipy - Retinal Image Processing on Python
+# Copyright (C) 2018  Maria Aguiar
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Helpers used by the endpoints to read the uploaded images and to answer with binary images.
+
+Images can be uploaded in three ways:
+ * a JSON body with each image as a base64 string, in the field named after the image.
+ * a multipart/form-data body with each image as a part named after the image.
+ * an application/octet-stream body with the image itself, only for endpoints with a single image.
+
+Endpoints that produce an image answer with the raw png instead of JSON when the request has the
+format=png query parameter.
+"""
+
+import base64
+import io
+import flask
+
+PNG_FORMAT = "png"
+
+
+def uploaded_images(*names: str) -> list:
+    """
+    Finds the given images in the current request, without decoding them. Multipart and raw
+    uploads are read as they are, without the base64 step of the JSON ones. Every call returns
+    files positioned at the start of the images, so the images can be read more than once.
+    :param names: the names of the images
+    :return: a list with a binary file object per image, or None if any image is missing
+    """
+    request = flask.request
+    if request.mimetype == "application/octet-stream":
+        if len(names) != 1 or not request.content_length:
+            return None
+        return [io.BytesIO(request.get_data())]
+    if request.mimetype == "multipart/form-data":
+        files = [request.files.get(name) for name in names]
+        if None in files:
+            return None
+        for file in files:
+            file.stream.seek(0)
+        return [file.stream for file in files]
+
+    json = request.get_json(silent=True)
+    if json is None or any(name not in json for name in names):
+        return None
+    return [io.BytesIO(base64.b64decode(json[name])) for name in names]
+
+
+def png_requested() -> bool:
+    """
+    :return: True if the current request asks for a binary png answer.
+    """
+    return flask.request.args.get("format") == PNG_FORMAT
+
+
+def png_response(png: bytes, headers: dict = None) -> flask.Response:
+    """
+    Builds an answer with the given png file.
+    :param png: the bytes of the png file
+    :param headers: extra headers of the answer
+    :return: the flask response
+    """
+    return flask.Response(png, mimetype="image/png", headers=headers)
@@ -0,0 +1,112 @@
+# Retipy - Retinal Image Processing on Python
+# Copyright (C) 2018  Maria Aguiar
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""tests for the result cache and its endpoint"""
+
+import base64
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from PIL import Image
+from retipy.retina import Retina
+from retipyserver import app
+from retipyserver import cache
+from unittest import TestCase
+
+
+class TestCacheEndpoint(TestCase):
+    _image_path = 'retipy/resources/images/img01.png'
+
+    def setUp(self):
+        self._results = cache.results
+        cache.results = cache.ResultCache()
+        self.app = app.test_client()
+        self.png = Retina.get_png_image(Retina(None, self._image_path).np_image * 255)
+
+    def tearDown(self):
+        cache.results = self._results
+
+    def _data(self, response):
+        return json.loads(response.get_data().decode(sys.getdefaultencoding()))
+
+    def _statistics(self):
+        return self._data(self.app.get("/retipy/cache"))
+
+    def _density(self, png):
+        return self.app.post(
+            "/retipy/tortuosity/density", data=png, content_type="application/octet-stream")
+
+    def test_cache_hit(self):
+        expected = self._data(self._density(self.png))
+        statistics = self._statistics()
+        self.assertEqual((statistics["hits"], statistics["misses"], statistics["entries"]), (0, 1, 1))
+
+        # the same file hits the cache through another kind of upload
+        response = self.app.post(
+            "/retipy/tortuosity/density", json={"image": base64.b64encode(self.png).decode("utf-8")})
+        self.assertEqual(self._data(response), expected, "cached response does not match")
+        self.assertEqual(self._statistics()["hits"], 1)
+
+        # the key is built from the uploaded bytes, another encoding of the same pixels is a new entry
+        bmp = io.BytesIO()
+        Image.open(io.BytesIO(self.png)).save(bmp, format="BMP")
+        self.assertEqual(self._data(self._density(bmp.getvalue())), expected, "response does not match")
+        self.assertEqual(self._statistics()["misses"], 2)
+
+        # the endpoint is part of the key
+        self.app.post("/retipy/tortuosity/fractal", data=self.png, content_type="application/octet-stream")
+        self.assertEqual(self._statistics()["misses"], 3)
+
+    def test_cache_no_image(self):
+        self.app.post("/retipy/tortuosity/density")
+        self.assertEqual(self._statistics(), {"hits": 0, "disk_hits": 0, "misses": 0, "entries": 0, "bytes": 0})
+
+    def test_cache_disk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache.results = cache.ResultCache(directory=directory)
+            expected = self._data(self._density(self.png))
+            cache.results = cache.ResultCache(max_bytes=0, directory=directory)
+            self.assertEqual(self._data(self._density(self.png)), expected, "disk response does not match")
+            statistics = self._statistics()
+            self.assertEqual((statistics["disk_hits"], statistics["misses"], statistics["entries"]), (1, 0, 0))
+
+    def test_cache_eviction(self):
+        results = cache.ResultCache(max_bytes=10)
+        results.put("a", (200, [], b"12345"))
+        results.put("b", (200, [], b"12345"))
+        self.assertIsNotNone(results.get("a"))
+        results.put("c", (200, [], b"12345"))
+        self.assertIsNone(results.get("b"))
+        self.assertIsNotNone(results.get("a"))
+        results.put("d", (200, [], b"12345678901"))
+        self.assertIsNone(results.get("d"))
+        self.assertEqual(results.statistics(), {"hits": 2, "disk_hits": 0, "misses": 2, "entries": 2, "bytes": 10})
+
+    def test_cache_disk_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            results = cache.ResultCache(max_bytes=0, directory=directory, max_disk_bytes=100)
+            results.put("a", (200, [], b"1" * 40))
+            results.put("b", (200, [], b"1" * 40))
+            # the files also hold the status and the headers, a third response does not fit
+            time.sleep(0.01)
+            self.assertIsNotNone(results.get("a"))
+            results.put("c", (200, [], b"1" * 40))
+            self.assertEqual(sorted(os.listdir(directory)), ["a", "c"], "least recently used file should be removed")
+            results.put("d", (200, [], b"1" * 101))
+            self.assertIsNone(results.get("d"))
@@ -0,0 +1,32 @@
+# Retipy - Retinal Image Processing on Python
+# Copyright (C) 2017  Alejandro Valdes
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""tests for drusen endpoint module"""
+
+import json
+import sys
+from retipyserver import app
+from unittest import TestCase
+
+
+class TestDrusenEndpoint(TestCase):
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def test_classification_by_size_no_success(self):
+        response = self.app.post("/retipy/drusenclassificationbysize")
+        self.assertEqual(json.loads(response.get_data().decode(sys.getdefaultencoding())), {'success': False})
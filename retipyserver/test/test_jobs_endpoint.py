@@ -0,0 +1,133 @@
+# Retipy - Retinal Image Processing on Python
+# Copyright (C) 2018  Maria Aguiar
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""tests for jobs endpoint module"""
+
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from retipy.retina import Retina
+from retipyserver import app
+from retipyserver import jobs
+from unittest import TestCase
+
+
+class TestJobsEndpoint(TestCase):
+    _image_path = 'retipy/resources/images/img01.png'
+
+    def setUp(self):
+        self._queue = jobs.queue
+        jobs.queue = jobs.JobQueue(workers=1, executor="thread", ttl=60)
+        self.app = app.test_client()
+        self.png = Retina.get_png_image(Retina(None, self._image_path).np_image * 255)
+
+    def tearDown(self):
+        jobs.queue.shutdown()
+        jobs.queue = self._queue
+
+    def _data(self, response):
+        return json.loads(response.get_data().decode(sys.getdefaultencoding()))
+
+    def _wait(self, job_id):
+        for _ in range(600):
+            status = self._data(self.app.get("/retipy/jobs/" + job_id))["status"]
+            if status not in (jobs.QUEUED, jobs.RUNNING):
+                return status
+            time.sleep(0.1)
+        self.fail("job {} did not finish".format(job_id))
+
+    def test_job_result(self):
+        expected = self.app.post(
+            "/retipy/tortuosity/density", data=self.png, content_type="application/octet-stream")
+        response = self.app.post(
+            "/retipy/jobs/tortuosity/density", data=self.png, content_type="application/octet-stream")
+        self.assertEqual(response.status_code, 202)
+        job_id = self._data(response)["id"]
+        self.assertEqual(response.headers["Location"], "/retipy/jobs/" + job_id)
+
+        self.assertEqual(self._wait(job_id), jobs.DONE)
+        result = self.app.get("/retipy/jobs/{}/result".format(job_id))
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(self._data(result), self._data(expected), "job result does not match")
+
+    def test_job_endpoint_response(self):
+        job_id = self._data(self.app.post("/retipy/jobs/drusenclassificationbysize"))["id"]
+        self.assertEqual(self._wait(job_id), jobs.DONE)
+        result = self.app.get("/retipy/jobs/{}/result".format(job_id))
+        self.assertEqual(self._data(result), {'success': False})
+
+    def test_job_unknown_endpoint(self):
+        self.assertEqual(self.app.post("/retipy/jobs/unknown").status_code, 404)
+        self.assertEqual(self.app.post("/retipy/jobs/status").status_code, 404)
+        self.assertEqual(self.app.post("/retipy/jobs/jobs/status").status_code, 404)
+
+    def test_job_unknown_id(self):
+        self.assertEqual(self.app.get("/retipy/jobs/unknown").status_code, 404)
+        self.assertEqual(self.app.get("/retipy/jobs/unknown/result").status_code, 404)
+        self.assertEqual(self.app.delete("/retipy/jobs/unknown").status_code, 404)
+
+    def test_job_cancel(self):
+        blocker = threading.Event()
+        jobs.queue._pool = jobs.ThreadPoolExecutor(max_workers=1)
+        jobs.queue._pool.submit(blocker.wait)
+        job_id = self._data(self.app.post("/retipy/jobs/tortuosity/fractal"))["id"]
+        self.assertEqual(self._data(self.app.get("/retipy/jobs/" + job_id))["status"], jobs.QUEUED)
+        result = self.app.get("/retipy/jobs/{}/result".format(job_id))
+        self.assertEqual(result.status_code, 202)
+
+        cancelled = self.app.delete("/retipy/jobs/" + job_id)
+        self.assertEqual(self._data(cancelled), {"id": job_id, "status": jobs.CANCELLED})
+        blocker.set()
+        self.assertEqual(self.app.get("/retipy/jobs/{}/result".format(job_id)).status_code, 410)
+
+    def test_job_limit_and_ttl(self):
+        jobs.queue = jobs.JobQueue(workers=1, executor="thread", ttl=0, limit=1)
+        blocker = threading.Event()
+        jobs.queue._pool = jobs.ThreadPoolExecutor(max_workers=1)
+        jobs.queue._pool.submit(blocker.wait)
+        job_id = self._data(self.app.post("/retipy/jobs/tortuosity/fractal"))["id"]
+        self.assertEqual(self.app.post("/retipy/jobs/tortuosity/fractal").status_code, 503)
+        blocker.set()
+        jobs.queue._jobs[job_id].future.result()
+        time.sleep(0.01)
+        self.assertEqual(self.app.get("/retipy/jobs/" + job_id).status_code, 404)
+
+    def test_job_process_pool_recovery(self):
+        jobs.queue = jobs.JobQueue(workers=1, executor="process", ttl=60)
+        job_ids = [
+            self._data(self.app.post(
+                "/retipy/jobs/tortuosity/density", data=self.png, content_type="application/octet-stream"))["id"]
+            for _ in range(2)]
+        # a worker killed while it runs a job (e.g. out of memory) breaks the whole process pool,
+        # the running job and the queued one fail without waiting for another submit
+        while not multiprocessing.active_children():
+            time.sleep(0.01)
+        for child in multiprocessing.active_children():
+            os.kill(child.pid, signal.SIGKILL)
+        for job_id in job_ids:
+            self.assertEqual(self._wait(job_id), jobs.FAILED)
+            self.assertEqual(self.app.get("/retipy/jobs/{}/result".format(job_id)).status_code, 410)
+
+        response = self.app.post("/retipy/jobs/tortuosity/fractal")
+        self.assertEqual(response.status_code, 202)
+        job_id = self._data(response)["id"]
+        self.assertEqual(self._wait(job_id), jobs.DONE)
+        result = self.app.get("/retipy/jobs/{}/result".format(job_id))
+        self.assertEqual(self._data(result), {'success': False})
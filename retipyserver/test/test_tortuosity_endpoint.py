@@ -16,6 +16,8 @@
 
 """tests for tortuosity endpoint module"""
 
+import base64
+import io
 import json
 import sys
 from retipy.retina import Retina
@@ -39,3 +41,32 @@ class TestTortuosityEndpoint(TestCase):
     def test_fractal_no_success(self):
         response = self.app.post("/retipy/tortuosity/fractal")
         self.assertEqual(json.loads(response.get_data().decode(sys.getdefaultencoding())), {'success': False})
+
+    def _data(self, response):
+        return json.loads(response.get_data().decode(sys.getdefaultencoding()))
+
+    def test_density_uploads(self):
+        png = Retina.get_png_image(Retina(None, self._image_path).np_image * 255)
+        expected = self._data(self.app.post(
+            "/retipy/tortuosity/density", json={"image": base64.b64encode(png).decode("utf-8")}))
+        self.assertEqual(expected["uri"], "tortuosity_density", "uri does not match")
+        raw = self.app.post(
+            "/retipy/tortuosity/density", data=png, content_type="application/octet-stream")
+        self.assertEqual(self._data(raw), expected, "raw upload does not match")
+        multipart = self.app.post(
+            "/retipy/tortuosity/density",
+            data={"image": (io.BytesIO(png), "img01.png")},
+            content_type="multipart/form-data")
+        self.assertEqual(self._data(multipart), expected, "multipart upload does not match")
+
+    def test_density_empty_upload(self):
+        response = self.app.post(
+            "/retipy/tortuosity/density", data=b"", content_type="application/octet-stream")
+        self.assertEqual(self._data(response), {'success': False})
+
+    def test_fractal_missing_part(self):
+        response = self.app.post(
+            "/retipy/tortuosity/fractal",
+            data={"other": (io.BytesIO(b"1"), "other.png")},
+            content_type="multipart/form-data")
+        self.assertEqual(self._data(response), {'success': False})
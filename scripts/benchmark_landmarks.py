@@ -0,0 +1,41 @@
+import time
+import numpy as np
+from unittest import TestCase
+from retipy import landmarks as l
+
+
+class BenchmarkLandmarks(TestCase):
+    _spacing = 8
+    _lines = 60
+
+    def setUp(self):
+        # a grid of vessels, every intersection is a landmark
+        size = self._spacing * (self._lines + 1)
+        self._skeleton = np.full([size, size, 3], 255, dtype=np.uint8)
+        self._landmarks = []
+        for i in range(1, self._lines + 1):
+            for j in range(1, self._lines + 1):
+                x = i * self._spacing
+                y = j * self._spacing
+                colour = [0, 0, 255] if (i + j) % 2 else [255, 0, 0]
+                self._skeleton[x - 1:x + 2, y - 1:y + 2] = colour
+                self._landmarks.append([x, y])
+                self._landmarks.append([x + 1, y + 1])
+
+    def test_benchmark_principal_boxes(self):
+        start = time.perf_counter()
+        bifurcations, crossings = l.principal_boxes(self._skeleton, self._landmarks, 0)
+        elapsed = time.perf_counter() - start
+        print("principal_boxes: {} landmarks, {} boxes in {:.3f}s".format(
+            len(self._landmarks), len(bifurcations) + len(crossings), elapsed))
+
+        start = time.perf_counter()
+        junct = self._landmarks.copy()
+        expected_bifurcations = []
+        expected_crossings = []
+        while junct:
+            junct = l.boxes_auxiliary(self._skeleton, junct, 0, expected_bifurcations, expected_crossings)
+        print("boxes_auxiliary: {:.3f}s".format(time.perf_counter() - start))
+
+        self.assertEqual(expected_bifurcations, bifurcations)
+        self.assertEqual(expected_crossings, crossings)
@@ -0,0 +1,36 @@
+import glob
+import os
+import time
+from unittest import TestCase
+from retipy import tortuosity
+from retipy.retina import Retina
+
+
+class BenchmarkTortuosityWindows(TestCase):
+    # the pools are an opt-in of tortuosity.density and tortuosity.fractal, this compares them with
+    # the default serial extraction and only shows a speed-up with more than one core
+    _images = os.path.join(os.path.dirname(__file__), "..", "retipy", "resources", "images", "img*.png")
+    _workers = max(os.cpu_count() or 1, 2)
+
+    def setUp(self):
+        self._segmented = [Retina(None, path).np_image for path in sorted(glob.glob(self._images))]
+
+    def _benchmark(self, measure):
+        start = time.perf_counter()
+        expected = [measure(image) for image in self._segmented]
+        print("{}: {} images serially in {:.3f}s".format(
+            measure.__name__, len(self._segmented), time.perf_counter() - start))
+
+        for executor in ["thread", "process"]:
+            start = time.perf_counter()
+            evaluations = [
+                measure(image, workers=self._workers, executor=executor) for image in self._segmented]
+            print("{}: {} {} workers in {:.3f}s".format(
+                measure.__name__, self._workers, executor, time.perf_counter() - start))
+            self.assertEqual(expected, evaluations)
+
+    def test_benchmark_density(self):
+        self._benchmark(tortuosity.density)
+
+    def test_benchmark_fractal(self):
+        self._benchmark(tortuosity.fractal)